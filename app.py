@@ -3,42 +3,142 @@ from streamlit_chat import message
 from PIL import Image
 import numpy as np
 import torch
+import os
 import time
 import uuid
 import logging
 import inspect
-import asyncio
+from concurrent.futures import ThreadPoolExecutor
 
 # Importation des modules personnalisés
-from modules.detection import load_model, predict_with_yolo, display_results
+from modules.detection import load_model, predict_with_yolo_cached, display_results, get_highest_confidence
 from modules.chat import get_bot_response, load_llama_model
-from modules.knowledge import extract_text_from_pdfs, extract_text_from_urls
+from modules.knowledge import extract_text_from_pdfs, fetch_urls_text
 # Importation directe depuis utils.py
 from modules.utils import (
     detect_language,
+    preview_llama_response,
 )
 from utils import CustomStreamingCallbackHandler,CustomStreamingCallbackHandlerWHatsapp,timer_decorator
 # Importation du gestionnaire de callbacks existant
 from modules.callbacks import callback_manager, on_tumor_detection, on_message_received, on_error_occurred
 from config import (
-    LLAMA_MODEL_PATH, UNIFIED_MODEL_PATH, PDF_PATHS, URLS, 
+    LLAMA_MODEL_PATH, UNIFIED_MODEL_PATH, PDF_PATHS, URLS, STREAM_FLUSH_INTERVAL,
+    CHAT_DISPLAY_LIMIT, MALIGNANCY_THRESHOLD,
     set_page_config
 )
 
 # Configuration de la page Streamlit
 set_page_config()
 
+# Existence du fichier modèle Llama, vérifiée une seule fois à l'import
+_LLAMA_PATH_OK = os.path.exists(LLAMA_MODEL_PATH)
+
+# Sélection automatique des algorithmes cuDNN les plus rapides (entrées de taille fixe)
+torch.backends.cudnn.benchmark = True
+
 # Configuration du logger pour supprimer les messages de Streamlit
 logger = logging.getLogger('streamlit')
 logger.setLevel(logging.ERROR)
 
+# Messages automatiques après l'analyse d'image, par (langue, classification)
+DETECTION_RESPONSES = {
+    ("fr", "cancer"): "J'ai analysé votre image et j'ai détecté une tumeur classée comme 'maligne'. Cette classification suggère un cancer potentiel. Je vous recommande de consulter un médecin dès que possible pour une évaluation professionnelle.",
+    ("fr", "benign"): "J'ai analysé votre image et j'ai détecté une tumeur classée comme 'bénigne'. Cette classification suggère une tumeur non cancéreuse, mais un suivi médical est toujours recommandé.",
+    ("en", "cancer"): "I have analyzed your image and detected a tumor classified as 'malignant'. This classification suggests a potential cancer. I recommend consulting a doctor as soon as possible for a professional evaluation.",
+    ("en", "benign"): "I have analyzed your image and detected a tumor classified as 'benign'. This classification suggests a non-cancerous tumor, but medical follow-up is still recommended.",
+    ("ar", "cancer"): "لقد قمت بتحليل صورتك واكتشفت ورمًا مصنفًا على أنه 'خبيث'. يشير هذا التصنيف إلى احتمال وجود سرطان. أوصي باستشارة الطبيب في أقرب وقت ممكن للحصول على تقييم مهني.",
+    ("ar", "benign"): "لقد قمت بتحليل صورتك واكتشفت ورمًا مصنفًا على أنه 'حميد'. يشير هذا التصنيف إلى ورم غير سرطاني، ولكن لا يزال يُنصح بالمتابعة الطبية.",
+}
+
+@st.cache_resource(show_spinner=False)
+def _get_yolo(model_path):
+    """Charge le modèle YOLO une seule fois par processus."""
+    return load_model(model_path)
+
+@st.cache_resource(show_spinner=False)
+def _get_llama(model_path):
+    """Charge le modèle LLama une seule fois par processus."""
+    return load_llama_model(model_path)
+
+def _build_kb(pdf_paths, urls):
+    """
+    Construit la base de connaissances à partir des PDFs et des URLs.
+    
+    Args:
+        pdf_paths (tuple): Chemins des PDFs
+        urls (tuple): URLs à extraire
+        
+    Returns:
+        str: Base de connaissances combinée
+    """
+    # Extraction des PDFs pendant le téléchargement des URLs
+    # (les textes déjà extraits sont relus depuis le cache disque)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pdf_text = executor.submit(extract_text_from_pdfs, pdf_paths)
+        
+        url_text = ""
+        for url, text in zip(urls, fetch_urls_text(urls)):
+            if isinstance(text, Exception):
+                logger.error(f"Erreur lors de l'extraction du texte depuis {url}: {text}")
+                on_error_occurred("knowledge_extraction_error", str(text), "knowledge_url")
+            else:
+                url_text += text + "\n\n"
+        
+        return pdf_text.result() + "\n\n" + url_text
+
+@st.cache_resource(show_spinner=False)
+def _get_kb_future(pdf_paths, urls):
+    """
+    Lance la construction de la base de connaissances en arrière-plan.
+    
+    Appelée une seule fois par processus: toutes les sessions partagent le même
+    futur, et donc le même texte (chaîne immuable), sans bloquer l'interface.
+    
+    Args:
+        pdf_paths (tuple): Chemins des PDFs
+        urls (tuple): URLs à extraire
+        
+    Returns:
+        concurrent.futures.Future: Futur de la base de connaissances
+    """
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="knowledge-base")
+    future = executor.submit(_build_kb, pdf_paths, urls)
+    # Le thread se termine une fois la tâche soumise achevée
+    executor.shutdown(wait=False)
+    return future
+
+def _current_knowledge_base():
+    """
+    Renvoie la base de connaissances si elle est prête.
+    
+    Returns:
+        str: Base de connaissances, ou chaîne vide pendant son chargement
+    """
+    ss = st.session_state
+    future = ss.get("kb_future")
+    if future is not None and future.done():
+        ss.kb_future = None
+        try:
+            ss.knowledge_base = future.result()
+        except Exception as e:
+            logger.error(f"Erreur lors de l'extraction des connaissances: {e}")
+            ss.knowledge_base = ""
+            on_error_occurred("knowledge_extraction_error", str(e), "knowledge")
+            # Évincer le futur en échec (s'il n'a pas déjà été remplacé par une
+            # autre session) pour relancer la construction à la prochaine exécution
+            if _get_kb_future(tuple(PDF_PATHS), tuple(URLS)) is future:
+                _get_kb_future.clear()
+            ss.kb_future = _get_kb_future(tuple(PDF_PATHS), tuple(URLS))
+    return ss.knowledge_base
+
 def load_resources_silently():
     """
     Fonction pour charger silencieusement tous les modèles et ressources nécessaires
     """
     # Chargement du modèle YOLO
     try:
-        st.session_state.model = load_model(UNIFIED_MODEL_PATH)
+        st.session_state.model = _get_yolo(UNIFIED_MODEL_PATH)
         if not st.session_state.model:
             logger.error("Échec du chargement du modèle YOLO.")
             on_error_occurred("model_loading_error", "Échec du chargement du modèle YOLO", "detection")
@@ -48,15 +148,14 @@ def load_resources_silently():
     
     # Chargement du modèle LLama
     try:
-        # Vérifier l'existence du fichier
-        import os
-        if not os.path.exists(LLAMA_MODEL_PATH):
+        # Vérifier l'existence du fichier (vérifiée une fois au démarrage)
+        if not _LLAMA_PATH_OK:
             logger.error(f"Le fichier modèle Llama n'existe pas: {LLAMA_MODEL_PATH}")
             on_error_occurred("model_loading_error", f"Fichier introuvable: {LLAMA_MODEL_PATH}", "chat")
             st.session_state.llama_model = None
             st.session_state.use_llama = False
         else:
-            st.session_state.llama_model = load_llama_model(LLAMA_MODEL_PATH)
+            st.session_state.llama_model = _get_llama(LLAMA_MODEL_PATH)
             if not st.session_state.llama_model:
                 logger.warning("Échec du chargement du modèle LLama.")
                 st.session_state.use_llama = False
@@ -66,23 +165,9 @@ def load_resources_silently():
         st.session_state.use_llama = False
         on_error_occurred("model_loading_error", str(e), "chat")
     
-    # Extraction des connaissances
-    try:
-        pdf_text = extract_text_from_pdfs(PDF_PATHS)
-    except Exception as e:
-        logger.error(f"Erreur lors du traitement des PDFs: {e}")
-        pdf_text = ""
-        on_error_occurred("knowledge_extraction_error", str(e), "knowledge_pdf")
-    
-    try:
-        url_text = extract_text_from_urls(URLS)
-    except Exception as e:
-        logger.error(f"Erreur lors du traitement des URLs: {e}")
-        url_text = ""
-        on_error_occurred("knowledge_extraction_error", str(e), "knowledge_url")
-    
-    # Combiner les textes disponibles
-    st.session_state.knowledge_base = pdf_text + "\n\n" + url_text
+    # Extraction des connaissances en arrière-plan (partagée entre les sessions):
+    # l'application est utilisable avant la fin du chargement
+    st.session_state.kb_future = _get_kb_future(tuple(PDF_PATHS), tuple(URLS))
 
 def main():
     st.title("🏥 Chatbot de Détection de Cancer du Sein")
@@ -100,9 +185,15 @@ def main():
     if 'knowledge_base' not in st.session_state:
         st.session_state.knowledge_base = ""
     
+    if 'kb_future' not in st.session_state:
+        st.session_state.kb_future = None
+    
     if 'messages' not in st.session_state:
         st.session_state.messages = []
     
+    if 'last_user_msg' not in st.session_state:
+        st.session_state.last_user_msg = None
+    
     if 'uploaded_image' not in st.session_state:
         st.session_state.uploaded_image = None
         
@@ -154,10 +245,25 @@ def sidebar_section():
         
         # Section des callbacks (optionnelle)
         with st.expander("Options avancées"):
+            # L'historique des événements n'est tenu que si l'utilisateur l'active
+            recording = st.checkbox(
+                "Enregistrer l'historique des événements",
+                value=bool(callback_manager.record_history)
+            )
+            if recording and not callback_manager.record_history:
+                callback_manager.enable_history()
+            elif not recording and callback_manager.record_history:
+                callback_manager.disable_history()
+            
             if st.button("Sauvegarder l'historique"):
-                save_path = f"session_history_{st.session_state.session_id}.json"
-                callback_manager.save_history(save_path)
-                st.success(f"Historique sauvegardé dans {save_path}")
+                save_path = f"session_history_{st.session_state.session_id}.jsonl"
+                written = callback_manager.save_history(save_path)
+                if written is None:
+                    st.error("Erreur lors de la sauvegarde de l'historique")
+                elif written == 0:
+                    st.info("Aucun nouvel événement à sauvegarder")
+                else:
+                    st.success(f"Historique sauvegardé dans {save_path} ({written} événements)")
             
             if st.button("Effacer l'historique"):
                 callback_manager.clear_history()
@@ -184,6 +290,7 @@ def sidebar_section():
         
         if st.button("Réinitialiser la conversation"):
             st.session_state.messages = []
+            st.session_state.last_user_msg = None
             st.session_state.uploaded_image = None
             st.session_state.detected_condition = None
             
@@ -201,13 +308,18 @@ def sidebar_section():
 def chat_section():
     """Section pour l'interface de chat"""
     st.subheader("💬 Conversation")
+    ss = st.session_state
     
-    # Affichage des messages
-    for i, msg in enumerate(st.session_state.messages):
-        if msg["role"] == "user":
-            message(msg["content"], is_user=True, key=f"msg_{i}")
-        else:
-            message(msg["content"], is_user=False, key=f"msg_{i}")
+    # Affichage des messages: seuls les CHAT_DISPLAY_LIMIT derniers sont rendus
+    # à chaque exécution, les plus anciens uniquement à la demande
+    messages = ss.messages
+    first_visible = max(len(messages) - CHAT_DISPLAY_LIMIT, 0)
+    if first_visible and st.checkbox(f"Afficher les {first_visible} messages précédents", key="show_older_messages"):
+        first_visible = 0
+    
+    for i in range(first_visible, len(messages)):
+        msg = messages[i]
+        message(msg["content"], is_user=(msg["role"] == "user"), key=f"msg_{i}")
     
     # Zone de saisie du message
     with st.form(key="message_form", clear_on_submit=True):
@@ -217,47 +329,52 @@ def chat_section():
     # Traitement du message
     if submit_button and user_input:
         # Ajouter le message de l'utilisateur
-        st.session_state.messages.append({"role": "user", "content": user_input})
+        messages.append({"role": "user", "content": user_input})
+        ss.last_user_msg = user_input
         
-        # Vérifier la disponibilité du modèle LLama
-        use_llama_now = st.session_state.get('llama_model') is not None
+        # Ressources de la session (modèle LLama éventuellement indisponible)
+        llama_model = ss.get('llama_model')
+        knowledge_base = _current_knowledge_base()
+        detected_condition = ss.detected_condition
+        # Gestionnaire propre à cette requête: les callbacks ne s'accumulent pas d'un message à l'autre
+        streaming_handler = CustomStreamingCallbackHandlerWHatsapp(mode=ss.streaming_handler.mode)
         
         # Configuration pour l'affichage progressif de la réponse
         response_placeholder = st.empty()
-        current_response = [""]
+        response_chunks = []
+        last_flush = [time.monotonic()]
         
-        # Fonction de callback pour afficher la réponse progressivement
+        def flush_response():
+            response_placeholder.markdown(preview_llama_response("".join(response_chunks)))
+            last_flush[0] = time.monotonic()
+        
+        # Fonction de callback pour afficher la réponse progressivement:
+        # les fragments sont regroupés et l'affichage n'est rafraîchi qu'au plus
+        # une fois par STREAM_FLUSH_INTERVAL secondes
         def update_response(text_chunk):
-            current_response[0] += text_chunk
-            response_placeholder.markdown(current_response[0])
+            response_chunks.append(text_chunk)
+            if time.monotonic() - last_flush[0] >= STREAM_FLUSH_INTERVAL:
+                flush_response()
         
         # Enregistrer le callback dans le gestionnaire de streaming
-        st.session_state.streaming_handler.register_callback(update_response)
+        streaming_handler.register_callback(update_response)
         
         # Générer la réponse avec un indicateur de chargement
         with st.spinner("Réponse en cours..."):
             try:
                 detected_language = detect_language(user_input)
                 
-                # Essayer d'utiliser la version modifiée de get_bot_response qui accepte streaming_callback
-                try:
-                    response = get_bot_response(
-                        user_input, 
-                        st.session_state.llama_model if use_llama_now else None,
-                        st.session_state.knowledge_base,
-                        st.session_state.detected_condition,
-                        streaming_callback=st.session_state.streaming_handler
-                    )
-                except TypeError:
-                    # Si la fonction n'accepte pas le paramètre streaming_callback
-                    logger.warning("La fonction get_bot_response ne supporte pas le streaming")
-                    response = get_bot_response(
-                        user_input, 
-                        st.session_state.llama_model if use_llama_now else None,
-                        st.session_state.knowledge_base,
-                        st.session_state.detected_condition
-                    )
-                    # Afficher manuellement la réponse complète
+                # Les fragments générés par LLama sont affichés au fil de l'eau
+                response = get_bot_response(
+                    user_input, 
+                    llama_model,
+                    knowledge_base,
+                    detected_condition,
+                    streaming_callback=streaming_handler
+                )
+                
+                # Les réponses prédéfinies (salutations, repli) ne passent pas par le streaming
+                if not response_chunks:
                     update_response(response)
                 
                 # Déclencher le callback de message
@@ -277,8 +394,11 @@ def chat_section():
                 update_response(response)
                 on_error_occurred("response_generation_error", str(e), "chat")
         
+        # Afficher les derniers fragments en attente
+        flush_response()
+        
         # Ajouter la réponse du bot
-        st.session_state.messages.append({"role": "assistant", "content": response})
+        messages.append({"role": "assistant", "content": response})
         
         # Forcer le rafraîchissement
         st.rerun()
@@ -286,24 +406,25 @@ def chat_section():
 def image_analysis_section():
     """Section pour l'analyse d'image"""
     st.subheader("🔍 Analyse d'Image")
+    ss = st.session_state
     
     # Upload d'image
     uploaded_file = st.file_uploader("Choisissez une image mammographique", type=["jpg", "jpeg", "png"])
     
     if uploaded_file is not None:
         image = Image.open(uploaded_file)
-        st.session_state.uploaded_image = image
+        ss.uploaded_image = image
+        model = ss.model
         
         # Vérifier les modèles disponibles
-        if st.session_state.model is not None:
+        if model is not None:
             with st.spinner("Analyse en cours..."):
                 try:
                     # Résultats YOLO - utilisation du seuil stocké dans session_state
-                    yolo_results = predict_with_yolo(
-                        st.session_state.model, 
-                        image, 
-                        st.session_state.conf_threshold
-                    )
+                    # (inference_mode: aucune comptabilité autograd; résultats réutilisés
+                    # pour la même image lors des réexécutions du script)
+                    with torch.inference_mode():
+                        yolo_results = predict_with_yolo_cached(model, image, ss.conf_threshold)
                     
                     # Vérifier si des tumeurs ont été détectées
                     has_detections = yolo_results and len(yolo_results) > 0 and len(yolo_results[0].boxes) > 0
@@ -311,15 +432,12 @@ def image_analysis_section():
                     # Si des tumeurs sont détectées, déclencher les callbacks
                     if has_detections:
                         # Récupérer la détection avec la plus haute confiance
-                        boxes = yolo_results[0].boxes
-                        highest_conf_idx = torch.argmax(boxes.conf).item()
-                        highest_conf = float(boxes.conf[highest_conf_idx])
+                        _, highest_conf = get_highest_confidence(yolo_results[0].boxes)
                         
                         # Générer un ID unique pour cette image
                         image_id = f"img_{int(time.time())}_{uploaded_file.name}"
                         
                         # Déterminer si la tumeur est maligne selon le seuil
-                        from config import MALIGNANCY_THRESHOLD
                         is_malignant = highest_conf > MALIGNANCY_THRESHOLD
                         
                         # Déclencher le callback de détection
@@ -330,38 +448,25 @@ def image_analysis_section():
                             image_path=uploaded_file.name
                         )
                     
-                    # Afficher les résultats
+                    # Afficher les résultats (met à jour detected_condition)
                     display_results(yolo_results, image)
+                    detected_condition = ss.detected_condition
                     
                     # Ajouter automatiquement un message du système concernant la détection
-                    if st.session_state.detected_condition:
+                    if detected_condition:
                         # Détecter la langue utilisée dans la conversation
                         user_lang = "fr"  # Par défaut en français
-                        if st.session_state.messages:
-                            last_user_msg = next((msg["content"] for msg in reversed(st.session_state.messages) 
-                                                if msg["role"] == "user"), None)
-                            if last_user_msg:
-                                user_lang = detect_language(last_user_msg)
+                        last_user_msg = ss.get("last_user_msg")
+                        if last_user_msg:
+                            user_lang = detect_language(last_user_msg)
                         
                         # Préparer la réponse dans la langue détectée
-                        if user_lang == "en":
-                            if st.session_state.detected_condition == "cancer":
-                                response = "I have analyzed your image and detected a tumor classified as 'malignant'. This classification suggests a potential cancer. I recommend consulting a doctor as soon as possible for a professional evaluation."
-                            else:
-                                response = "I have analyzed your image and detected a tumor classified as 'benign'. This classification suggests a non-cancerous tumor, but medical follow-up is still recommended."
-                        elif user_lang == "ar":
-                            if st.session_state.detected_condition == "cancer":
-                                response = "لقد قمت بتحليل صورتك واكتشفت ورمًا مصنفًا على أنه 'خبيث'. يشير هذا التصنيف إلى احتمال وجود سرطان. أوصي باستشارة الطبيب في أقرب وقت ممكن للحصول على تقييم مهني."
-                            else:
-                                response = "لقد قمت بتحليل صورتك واكتشفت ورمًا مصنفًا على أنه 'حميد'. يشير هذا التصنيف إلى ورم غير سرطاني، ولكن لا يزال يُنصح بالمتابعة الطبية."
-                        else:  # Français par défaut
-                            if st.session_state.detected_condition == "cancer":
-                                response = "J'ai analysé votre image et j'ai détecté une tumeur classée comme 'maligne'. Cette classification suggère un cancer potentiel. Je vous recommande de consulter un médecin dès que possible pour une évaluation professionnelle."
-                            else:
-                                response = "J'ai analysé votre image et j'ai détecté une tumeur classée comme 'bénigne'. Cette classification suggère une tumeur non cancéreuse, mais un suivi médical est toujours recommandé."
+                        response_lang = user_lang if user_lang in ("en", "ar") else "fr"
+                        response_kind = "cancer" if detected_condition == "cancer" else "benign"
+                        response = DETECTION_RESPONSES[(response_lang, response_kind)]
                         
                         # Ajouter la réponse du système à la conversation
-                        st.session_state.messages.append({"role": "assistant", "content": response})
+                        ss.messages.append({"role": "assistant", "content": response})
                         
                         # Déclencher le callback de message pour cette réponse automatique
                         on_message_received(
@@ -25,6 +25,16 @@ URLS = [
  
 ]
 
+# Nombre maximal de contextes LLama chargés en parallèle (un seul si le modèle est déchargé sur GPU)
+LLAMA_POOL_SIZE = 2
+# Nombre minimal de cœurs CPU attribués à chaque contexte LLama
+LLAMA_THREADS_PER_CONTEXT = 4
+
+# Répertoire du cache disque de la base de connaissances (textes extraits)
+KB_CACHE_DIR = "./.kb_cache"
+# Durée (en secondes) pendant laquelle le texte d'une URL en cache est réutilisé sans requête
+KB_URL_MAX_AGE = 24 * 60 * 60
+
 # Configuration de la page Streamlit
 def set_page_config():
     """
@@ -36,6 +46,17 @@ def set_page_config():
         layout="wide"
     )
 
+# Taille d'entrée (carrée) du modèle YOLO
+YOLO_IMGSZ = 640
+
+# Format d'export du modèle YOLO pour l'inférence sur CPU ("onnx", "openvino" ou None pour PyTorch)
+YOLO_EXPORT_FORMAT = None
+
 # Seuil de confiance pour la classification des tumeurs malignes/bénignes
 MALIGNANCY_THRESHOLD = 0.70
 
+# Intervalle minimal (en secondes) entre deux rafraîchissements de la réponse en streaming
+STREAM_FLUSH_INTERVAL = 0.03
+
+# Nombre de messages récents affichés dans la conversation (les plus anciens sont masqués)
+CHAT_DISPLAY_LIMIT = 20
@@ -2,43 +2,85 @@
 Module pour gérer les callbacks et événements dans l'application.
 """
 import logging
-from typing import Dict, Any, Callable, List, Optional
+import logging.handlers
+import queue
+import atexit
+from typing import Dict, Any, Callable, Deque, Iterable, List, Optional, Set
 import time
 import json
+from datetime import datetime
 import os
+from collections import deque
+from itertools import islice
 
-# Configuration du logging
+# Configuration du logging: les enregistrements sont placés dans une file et
+# écrits (fichier + console) par un thread d'arrière-plan, pour ne pas bloquer
+# le thread de l'application sur les écritures disque
+_log_queue = queue.Queue(-1)
+_log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+_file_handler = logging.FileHandler("app_events.log")
+_file_handler.setFormatter(_log_formatter)
+_stream_handler = logging.StreamHandler()
+_stream_handler.setFormatter(_log_formatter)
+_log_listener = logging.handlers.QueueListener(
+    _log_queue, _file_handler, _stream_handler, respect_handler_level=True
+)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+# Le formatage final est fait par les handlers du listener
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("app_events.log"),
-        logging.StreamHandler()
-    ]
+    format='%(message)s',
+    handlers=[logging.handlers.QueueHandler(_log_queue)]
 )
 
 logger = logging.getLogger(__name__)
 
 # Types de callbacks disponibles
-CALLBACK_TYPES = [
+CALLBACK_TYPES = frozenset({
     "on_detection",       # Déclenché quand une tumeur est détectée
     "on_classification",  # Déclenché quand une tumeur est classifiée
     "on_message",         # Déclenché quand un message est échangé
     "on_error",           # Déclenché en cas d'erreur
     "on_startup",         # Déclenché au démarrage de l'application
     "on_session_end",     # Déclenché à la fin d'une session
-]
+})
+
+def _serialize_event(event: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Prépare un événement pour l'écriture JSON.
+    
+    Les horodatages sont conservés en secondes (epoch) pendant l'exécution et
+    ne sont convertis en date lisible qu'au moment de la sérialisation.
+    
+    Args:
+        event: Événement de l'historique
+        
+    Returns:
+        Dict[str, Any]: Copie de l'événement avec le champ "timestamp_iso"
+    """
+    return {
+        **event,
+        "timestamp_iso": datetime.fromtimestamp(event["timestamp"]).isoformat(sep=" ", timespec="seconds")
+    }
 
 class CallbackManager:
     """Gestionnaire de callbacks pour l'application."""
     
     def __init__(self):
         """Initialise le gestionnaire de callbacks."""
-        self.callbacks: Dict[str, List[Callable]] = {
-            callback_type: [] for callback_type in CALLBACK_TYPES
-        }
-        self.history: List[Dict[str, Any]] = []
+        # Listes créées au premier enregistrement pour chaque type d'événement
+        self.callbacks: Dict[str, List[Callable]] = {}
         self.max_history = 100  # Nombre maximum d'entrées dans l'historique
+        # File bornée: les entrées les plus anciennes sont évincées automatiquement
+        self.history: Deque[Dict[str, Any]] = deque(maxlen=self.max_history)
+        # Types d'événements enregistrés dans l'historique même sans abonné
+        # (aucun par défaut: l'enregistrement s'active avant une sauvegarde)
+        self.record_history: Set[str] = set()
+        # Nombre total d'événements enregistrés et nombre déjà écrit par fichier
+        self._event_count = 0
+        self._persisted_counts: Dict[str, int] = {}
         
         # Enregistre le démarrage du gestionnaire
         logger.info("Gestionnaire de callbacks initialisé")
@@ -53,9 +95,9 @@ class CallbackManager:
         """
         if event_type not in CALLBACK_TYPES:
             raise ValueError(f"Type d'événement inconnu: {event_type}. "
-                            f"Les types valides sont: {', '.join(CALLBACK_TYPES)}")
+                            f"Les types valides sont: {', '.join(sorted(CALLBACK_TYPES))}")
         
-        self.callbacks[event_type].append(callback)
+        self.callbacks.setdefault(event_type, []).append(callback)
         logger.debug(f"Callback enregistré pour l'événement: {event_type}")
     
     def trigger(self, event_type: str, **kwargs) -> None:
@@ -66,49 +108,98 @@ class CallbackManager:
             event_type: Type d'événement à déclencher
             **kwargs: Arguments à passer aux callbacks
         """
-        if event_type not in CALLBACK_TYPES:
+        # Une seule recherche dans le dictionnaire pour les types avec abonnés
+        callbacks = self.callbacks.get(event_type)
+        if callbacks is None and event_type not in CALLBACK_TYPES:
             logger.warning(f"Tentative de déclenchement d'un événement inconnu: {event_type}")
             return
         
-        # Ajoute l'événement à l'historique
-        event_data = {
-            "type": event_type,
-            "timestamp": time.time(),
-            "data": kwargs
-        }
-        self.history.append(event_data)
+        # Ajoute l'événement à l'historique s'il a des abonnés ou si son
+        # enregistrement a été demandé
+        if callbacks or event_type in self.record_history:
+            self.history.append({
+                "type": event_type,
+                "timestamp": time.time(),
+                "data": kwargs
+            })
+            self._event_count += 1
         
-        # Limite la taille de l'historique
-        if len(self.history) > self.max_history:
-            self.history = self.history[-self.max_history:]
+        # Log l'événement (sans formater le message si le niveau INFO est désactivé)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f"Événement déclenché: {event_type}")
         
-        # Log l'événement
-        logger.info(f"Événement déclenché: {event_type}")
+        # Aucun abonné: rien d'autre à faire
+        if not callbacks:
+            return
         
         # Exécute tous les callbacks pour cet événement
-        for callback in self.callbacks[event_type]:
+        for callback in callbacks:
             try:
                 callback(**kwargs)
             except Exception as e:
                 logger.error(f"Erreur dans le callback pour {event_type}: {str(e)}")
     
-    def save_history(self, file_path: str = "callback_history.json") -> None:
+    def enable_history(self, event_types: Optional[Iterable[str]] = None) -> None:
+        """
+        Active l'enregistrement dans l'historique pour des types d'événements.
+        
+        Args:
+            event_types: Types à enregistrer (tous les types si None)
+        """
+        self.record_history.update(CALLBACK_TYPES if event_types is None else event_types)
+        logger.info("Enregistrement de l'historique des événements activé")
+    
+    def disable_history(self) -> None:
+        """Désactive l'enregistrement dans l'historique des événements sans abonné."""
+        self.record_history.clear()
+        logger.info("Enregistrement de l'historique des événements désactivé")
+    
+    def save_history(self, file_path: str = "callback_history.jsonl") -> Optional[int]:
         """
-        Sauvegarde l'historique des événements dans un fichier JSON.
+        Ajoute les nouveaux événements de l'historique à un fichier JSON Lines.
+        
+        Seuls les événements survenus depuis la dernière sauvegarde vers ce
+        fichier sont écrits (un objet JSON par ligne, en mode ajout).
         
         Args:
             file_path: Chemin du fichier où sauvegarder l'historique
+            
+        Returns:
+            Nombre d'événements écrits (0 si aucun nouvel événement), None en cas d'erreur
         """
         try:
-            with open(file_path, 'w') as f:
-                json.dump(self.history, f, indent=2)
-            logger.info(f"Historique sauvegardé dans {file_path}")
+            pending = self._event_count - self._persisted_counts.get(file_path, 0)
+            # Les événements évincés de l'historique borné ne peuvent plus être écrits
+            start = max(len(self.history) - pending, 0)
+            written = len(self.history) - start
+            if written:
+                with open(file_path, 'a') as f:
+                    for event in islice(self.history, start, None):
+                        f.write(json.dumps(_serialize_event(event)) + "\n")
+                logger.info(f"Historique sauvegardé dans {file_path}")
+            self._persisted_counts[file_path] = self._event_count
+            return written
         except Exception as e:
             logger.error(f"Erreur lors de la sauvegarde de l'historique: {str(e)}")
+            return None
+    
+    def export_full(self, file_path: str = "callback_history.json") -> None:
+        """
+        Exporte l'historique complet dans un fichier JSON (écrasé).
+        
+        Args:
+            file_path: Chemin du fichier d'export
+        """
+        try:
+            with open(file_path, 'w') as f:
+                json.dump([_serialize_event(event) for event in self.history], f, indent=2)
+            logger.info(f"Historique exporté dans {file_path}")
+        except Exception as e:
+            logger.error(f"Erreur lors de l'export de l'historique: {str(e)}")
     
     def clear_history(self) -> None:
         """Efface l'historique des événements."""
-        self.history = []
+        self.history.clear()
         logger.info("Historique des événements effacé")
 
 # Instance globale du gestionnaire de callbacks
@@ -150,7 +241,7 @@ def on_message_received(user_message: str, bot_response: str,
         user_message=user_message,
         bot_response=bot_response,
         detected_language=detected_language,
-        timestamp=time.strftime("%Y-%m-%d %H:%M:%S")
+        timestamp=time.time()
     )
 
 def on_error_occurred(error_type: str, error_message: str, 
@@ -168,7 +259,7 @@ def on_error_occurred(error_type: str, error_message: str,
         error_type=error_type,
         error_message=error_message,
         module=module,
-        timestamp=time.strftime("%Y-%m-%d %H:%M:%S")
+        timestamp=time.time()
     )
 
 # Exportation des fonctions et classes principales
@@ -1,15 +1,23 @@
 import streamlit as st
+import os
 import re
+import functools
+import unicodedata
 import numpy as np
+import llama_cpp
 from llama_cpp import Llama
 
 from modules.utils import (
     detect_language, 
     clean_llama_response, 
     generate_llama_prompt, 
-    get_fallback_response
+    get_fallback_response,
+    compile_keywords,
+    build_category_classifier
 )
 from modules.knowledge import extract_relevant_knowledge
+from modules.llama_pool import LlamaPool
+from config import LLAMA_POOL_SIZE, LLAMA_THREADS_PER_CONTEXT
 
 # Liste de mots-clés liés à la santé dans différentes langues
 HEALTH_KEYWORDS = {
@@ -36,6 +44,27 @@ HEALTH_KEYWORDS = {
     ]
 }
 
+# Mots-clés de santé compilés par langue: ceux de la langue, plus le français et l'anglais
+_HEALTH_KEYWORDS_RE = {
+    language: compile_keywords(keywords + HEALTH_KEYWORDS["fr"] + HEALTH_KEYWORDS["en"])
+    for language, keywords in HEALTH_KEYWORDS.items()
+}
+# Mêmes mots-clés sous forme d'ensembles, pour un test direct sur les mots du texte
+_HEALTH_KEYWORDS_SET = {
+    language: frozenset(keywords + HEALTH_KEYWORDS["fr"] + HEALTH_KEYWORDS["en"])
+    for language, keywords in HEALTH_KEYWORDS.items()
+}
+_TOKEN_RE = re.compile(r"\w+")
+
+# Marqueurs de fin de génération LLama
+LLAMA_STOP_SEQUENCES = ["<|user|>", "<|system|>", "<|assistant|>", "[INST]", "[/INST]", "</s>", "<s>"]
+# Nombre maximal de tokens générés par réponse
+LLAMA_MAX_TOKENS = 1024
+# Marge (en tokens) laissée entre le prompt, la réponse et la taille du contexte
+PROMPT_TOKEN_MARGIN = 16
+# Nombre de caractères à conserver pour détecter un marqueur réparti sur plusieurs fragments
+STOP_WINDOW = max(len(seq) for seq in LLAMA_STOP_SEQUENCES) * 2
+
 # Messages pour les sujets non liés à la santé
 OFF_TOPIC_MESSAGES = {
     "fr": "Je suis spécialisé dans les questions relatives au cancer du sein et à la santé. Je ne peux pas répondre à cette question qui semble en dehors de mon domaine d'expertise. Si vous avez des questions sur le cancer du sein, ses symptômes, traitements ou prévention, je serai ravi de vous aider.",
@@ -50,6 +79,14 @@ GREETINGS = {
     "ar": ["مرحبا", "أهلا", "السلام عليكم", "السلام عليكم ورحمة الله"]
 }
 
+# Salutation -> langue; en cas de doublon la première langue l'emporte
+_GREETING_LANG = {}
+for _lang, _greets in GREETINGS.items():
+    for _greeting in _greets:
+        _GREETING_LANG.setdefault(_greeting, _lang)
+# Salutations en début de texte, dans l'ordre de GREETINGS: la première qui correspond l'emporte
+_GREETING_RE = re.compile("(?:" + "|".join(re.escape(greeting) for greeting in _GREETING_LANG) + ")")
+
 # Réponses aux salutations
 GREETING_RESPONSES = {
     "fr": "Bonjour ! Comment puis-je vous aider concernant le cancer du sein ?",
@@ -57,6 +94,60 @@ GREETING_RESPONSES = {
     "ar": "مرحبًا! كيف يمكنني مساعدتك بشأن سرطان الثدي؟"
 }
 
+def available_cpu_count() -> int:
+    """
+    Renvoie le nombre de cœurs utilisables par le processus.
+    
+    Returns:
+        int: Nombre de cœurs (affinité du processus si disponible)
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def physical_cpu_count() -> int:
+    """
+    Renvoie le nombre de cœurs physiques utilisables par le processus.
+    
+    Les threads matériels (SMT/Hyper-Threading) d'un même cœur partagent ses
+    unités de calcul et son accès à la mémoire: ils sont comptés une seule fois.
+    
+    Returns:
+        int: Nombre de cœurs physiques (nombre de cœurs logiques si la topologie est inconnue)
+    """
+    try:
+        cpus = os.sched_getaffinity(0)
+    except AttributeError:
+        return available_cpu_count()
+    
+    # Un cœur physique = un ensemble distinct de threads matériels frères
+    cores = set()
+    for cpu in cpus:
+        try:
+            with open(f"/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list") as f:
+                cores.add(f.read().strip())
+        except OSError:
+            return len(cpus)
+    return len(cores) or len(cpus)
+
+def llama_pool_size(cpu_count: int) -> int:
+    """
+    Détermine le nombre de contextes LLama à charger.
+    
+    Sur GPU les poids seraient dupliqués en mémoire vidéo: un seul contexte.
+    Sur CPU, chaque contexte reçoit au moins LLAMA_THREADS_PER_CONTEXT cœurs.
+    
+    Args:
+        cpu_count (int): Nombre de cœurs disponibles
+        
+    Returns:
+        int: Taille du pool
+    """
+    if llama_cpp.llama_supports_gpu_offload():
+        return 1
+    return max(1, min(LLAMA_POOL_SIZE, cpu_count // LLAMA_THREADS_PER_CONTEXT))
+
 @st.cache_resource
 def load_llama_model(model_path):
     """
@@ -66,7 +157,7 @@ def load_llama_model(model_path):
         model_path (str): Chemin vers le fichier du modèle LLama
         
     Returns:
-        Llama: Modèle LLama chargé ou None en cas d'erreur
+        LlamaPool: Contextes LLama chargés ou None en cas d'erreur
     """
     try:
         from langchain_core.callbacks import CallbackManager
@@ -74,20 +165,65 @@ def load_llama_model(model_path):
         
         custom_callback = CustomStreamingCallbackHandler()
         callback_manager = CallbackManager([custom_callback])
-        return Llama(
-            model_path=model_path,
-            n_ctx=2048,  # Contexte limité à 2048 tokens
-            n_batch=256,  # Taille de batch pour l'inférence
-            verbose=True,  # Désactiver les logs verbeux
-            n_gpu_layers=-1,  # Utiliser le GPU si disponible (-1 = automatique)
-            f16_kv=True,
-            streaming=True,
-            callbacks=callback_manager
-        )
+        # Les cœurs disponibles sont répartis entre les contextes du pool
+        cpu_count = available_cpu_count()
+        pool_size = llama_pool_size(cpu_count)
+        threads = max(cpu_count // pool_size, 1)
+        # Génération: un thread par cœur physique du contexte, le décodage étant
+        # limité par la bande passante mémoire que se partagent les threads frères
+        generation_threads = max(min(physical_cpu_count() // pool_size, threads), 1)
+        return LlamaPool([
+            Llama(
+                model_path=model_path,
+                n_ctx=2048,  # Contexte limité à 2048 tokens
+                n_batch=2048,  # Taille de batch logique: le prompt est évalué en un seul passage
+                n_ubatch=512,  # Taille de batch physique envoyée au backend
+                n_threads=generation_threads,  # Génération: cœurs physiques uniquement
+                n_threads_batch=threads,  # Évaluation du prompt: limitée par le calcul
+                use_mmap=True,  # Poids projetés en mémoire plutôt que copiés (partagés entre les contextes)
+                use_mlock=False,
+                verbose=True,  # Désactiver les logs verbeux
+                n_gpu_layers=-1,  # Utiliser le GPU si disponible (-1 = automatique)
+                f16_kv=True,
+                streaming=True,
+                callbacks=callback_manager
+            )
+            for _ in range(pool_size)
+        ])
     except Exception as e:
         st.error(f"Erreur lors du chargement du modèle LLama: {e}")
         return None
 
+# Plages de caractères analysées pour la table de ponctuation: plan multilingue
+# de base et blocs de symboles et d'émojis
+_PUNCTUATION_RANGES = ((0x0000, 0x10000), (0x1F000, 0x1FB00))
+
+def _build_punctuation_table() -> dict:
+    """
+    Construit la table de traduction supprimant la ponctuation et les symboles.
+    
+    Sont supprimés les signes de ponctuation, symboles, marques combinantes et
+    caractères de contrôle ou de formatage, sauf '_', les espaces et les caractères arabes
+    (U+0600-U+06FF), comme le motif [^\\w\\s\\u0600-\\u06FF]. La table est
+    fixe: sa taille ne dépend pas des textes traités.
+    
+    Returns:
+        dict: Table pour str.translate
+    """
+    deleted = []
+    for start, stop in _PUNCTUATION_RANGES:
+        for codepoint in range(start, stop):
+            char = chr(codepoint)
+            category = unicodedata.category(char)
+            if char == "_" or char.isspace() or 0x0600 <= codepoint <= 0x06FF:
+                continue
+            if category[0] in "PSM" or category in ("Cc", "Cf"):
+                deleted.append(char)
+    return str.maketrans("", "", "".join(deleted))
+
+_PUNCT_TABLE = _build_punctuation_table()
+
+@functools.lru_cache(maxsize=1024)
 def clean_text(text: str) -> str:
     """
     Nettoie le texte en le mettant en minuscules et en supprimant la ponctuation.
@@ -98,8 +234,9 @@ def clean_text(text: str) -> str:
     Returns:
         str: Texte nettoyé
     """
-    return re.sub(r'[^\w\s\u0600-\u06FF]', '', text.lower()).strip()
+    return text.lower().translate(_PUNCT_TABLE).strip()
 
+@functools.lru_cache(maxsize=1024)
 def detect_greeting_language(text: str) -> str | None:
     """
     Détecte si le texte commence par une salutation et renvoie la langue.
@@ -113,17 +250,18 @@ def detect_greeting_language(text: str) -> str | None:
     cleaned = clean_text(text)
     
     # Vérifier si le texte commence par l'une des salutations connues
-    for lang, greets in GREETINGS.items():
-        for g in greets:
-            if cleaned.startswith(g):
-                return lang
-    
-    return None
+    match = _GREETING_RE.match(cleaned)
+    return _GREETING_LANG[match.group()] if match else None
 
+@functools.lru_cache(maxsize=1024)
 def is_health_related(text: str, language: str="fr") -> bool:
     """
     Vérifie si le texte est lié à la santé en se basant sur des mots-clés.
     
+    Les mots-clés de la langue, du français et de l'anglais sont d'abord
+    comparés aux mots du texte; sinon ils sont recherchés (y compris à
+    l'intérieur des mots et pour les expressions) en un seul passage.
+    
     Args:
         text (str): Texte à analyser
         language (str): Langue du texte (fr, en, ar)
@@ -131,30 +269,79 @@ def is_health_related(text: str, language: str="fr") -> bool:
     Returns:
         bool: True si le texte est lié à la santé, False sinon
     """
+    if language not in HEALTH_KEYWORDS:
+        language = "fr"
     txt = text.lower()
+    if not _HEALTH_KEYWORDS_SET[language].isdisjoint(_TOKEN_RE.findall(txt)):
+        return True
+    return _HEALTH_KEYWORDS_RE[language].search(txt) is not None
+
+class PromptTooLongError(ValueError):
+    """Le prompt dépasse la taille du contexte même sans extrait de connaissances."""
+
+def fit_prompt_tokens(pool, query: str, language: str, know: str) -> list:
+    """
+    Construit le prompt en tokens en tronquant l'extrait de connaissances si nécessaire.
     
-    # Vérifier les mots-clés dans la langue principale
-    for kw in HEALTH_KEYWORDS.get(language, HEALTH_KEYWORDS["fr"]):
-        if kw in txt:
-            return True
+    Le prompt doit laisser LLAMA_MAX_TOKENS tokens pour la réponse dans le
+    contexte du modèle. S'il est trop long, la plus longue portion de
+    l'extrait qui tient est trouvée par dichotomie sur le nombre réel de
+    tokens. Les tokens sont ensuite transmis tels quels à create_completion,
+    sans nouvelle conversion.
     
-    # Vérifier les mots-clés en français et en anglais quelle que soit la langue
-    for lang in ("fr", "en"):
-        if lang != language:
-            for kw in HEALTH_KEYWORDS[lang]:
-                if kw in txt:
-                    return True
+    Args:
+        pool (LlamaPool): Contextes LLama (pour la conversion en tokens)
+        query (str): Requête de l'utilisateur
+        language (str): Langue de la requête
+        know (str): Extrait de la base de connaissances
+        
+    Returns:
+        list: Tokens du prompt
+        
+    Raises:
+        PromptTooLongError: Si la question seule ne tient pas dans le budget
+    """
+    budget = pool.n_ctx() - LLAMA_MAX_TOKENS - PROMPT_TOKEN_MARGIN
+    
+    def tokens_for(length):
+        excerpt = know if length == len(know) else (know[:length] + "…" if length else "")
+        return pool.tokenize(generate_llama_prompt(query, language, excerpt, use_correction=True))
     
-    return False
+    tokens = tokens_for(len(know))
+    if len(tokens) <= budget:
+        return tokens
+    
+    # Sans extrait, le prompt (instructions et question) doit tenir dans le budget
+    best = tokens_for(0)
+    if len(best) > budget:
+        raise PromptTooLongError(
+            f"Prompt de {len(best)} tokens sans extrait, pour un budget de {budget} tokens"
+        )
+    
+    # Plus longue portion de l'extrait qui tient dans le budget
+    low, high = 0, len(know) - 1
+    while low <= high:
+        middle = (low + high) // 2
+        candidate = tokens_for(middle)
+        if len(candidate) <= budget:
+            best, low = candidate, middle + 1
+        else:
+            high = middle - 1
+    return best
 
-def get_llama_response(llama_model, query: str, knowledge_base: str) -> str:
+def get_llama_response(llama_model, query: str, knowledge_base: str, streaming_callback=None) -> str:
     """
     Obtient une réponse du modèle LLama.
     
+    La réponse est générée en streaming: chaque fragment est transmis au
+    gestionnaire de streaming dès sa production, et le nettoyage est appliqué
+    au texte complet une fois la génération terminée.
+    
     Args:
-        llama_model (Llama): Modèle LLama
+        llama_model (LlamaPool): Contextes LLama
         query (str): Requête de l'utilisateur
         knowledge_base (str): Base de connaissances
+        streaming_callback (optional): Gestionnaire de streaming (on_llm_new_token)
         
     Returns:
         str: Réponse générée
@@ -169,28 +356,41 @@ def get_llama_response(llama_model, query: str, knowledge_base: str) -> str:
     # Extraction d'information pertinente
     know = extract_relevant_knowledge(query, knowledge_base, language)
     
-    # Génération du prompt
-    prompt = generate_llama_prompt(query, language, know, use_correction=True)
-    
-    # Limiter la taille du prompt si nécessaire
-    if len(prompt) > 100000:
-        st.warning(f"Prompt trop long, troncature…")
-        prompt = generate_llama_prompt(query, language, know[:2000]+"…", use_correction=True)
-    
     try:
-        # Génération de la réponse
-        resp = llama_model.create_completion(
-            prompt,
-            max_tokens=1024,
-            temperature=0.7,
-            top_p=0.9,
-            repeat_penalty=1.2,
-            stop=["<|user|>", "<|system|>", "<|assistant|>", "[INST]", "[/INST]", "</s>", "<s>"],
-            echo=False
-        )
+        # Génération du prompt, converti en tokens et limité à la taille du contexte
+        prompt_tokens = fit_prompt_tokens(llama_model, query, language, know)
+        
+        # Génération de la réponse en streaming sur un contexte libre du pool
+        parts = []
+        with llama_model.acquire() as llama:
+            stream = llama.create_completion(
+                prompt_tokens,
+                max_tokens=LLAMA_MAX_TOKENS,
+                temperature=0.7,
+                top_p=0.9,
+                repeat_penalty=1.2,
+                stop=LLAMA_STOP_SEQUENCES,
+                echo=False,
+                stream=True
+            )
+            try:
+                tail = ""
+                for chunk in stream:
+                    token = chunk["choices"][0]["text"]
+                    parts.append(token)
+                    
+                    # Arrêt anticipé dès qu'un marqueur de fin apparaît dans le texte généré
+                    tail = (tail + token)[-STOP_WINDOW:]
+                    if any(seq in tail for seq in LLAMA_STOP_SEQUENCES):
+                        break
+                    
+                    if streaming_callback is not None:
+                        streaming_callback.on_llm_new_token(token)
+            finally:
+                stream.close()
         
-        # Extraction et nettoyage de la réponse
-        text = resp["choices"][0]["text"].strip()
+        # Extraction et nettoyage de la réponse complète
+        text = truncate_at_stop("".join(parts)).strip()
         
         # Vérifier si la réponse est vide ou trop courte
         if not text or len(text) < 10:
@@ -199,10 +399,36 @@ def get_llama_response(llama_model, query: str, knowledge_base: str) -> str:
         # Nettoyer la réponse
         return clean_llama_response(text, query)
         
+    except PromptTooLongError as e:
+        st.warning(f"Question trop longue pour le modèle LLaMA ({e}), réponse de repli utilisée.")
+        return get_fallback_response(query, language)
     except Exception as e:
         st.error(f"Erreur génération LLaMA: {e}")
         return get_fallback_response(query, language)
 
+def truncate_at_stop(text: str) -> str:
+    """
+    Coupe le texte au premier marqueur de fin rencontré.
+    
+    Args:
+        text (str): Texte généré
+        
+    Returns:
+        str: Texte précédant le premier marqueur de fin
+    """
+    positions = [text.find(seq) for seq in LLAMA_STOP_SEQUENCES]
+    positions = [pos for pos in positions if pos != -1]
+    return text[:min(positions)] if positions else text
+
+# Catégories des réponses prédéfinies, par ordre de priorité
+FALLBACK_CATEGORIES = [
+    ("cancer_info", ["cancer", "sein", "mammaire", "breast", "سرطان", "ثدي"]),
+    ("benign_info", ["bénin", "benin", "bénigne", "benign", "حميد"]),
+    ("malignant_info", ["malin", "maligne", "malignes", "malignant", "خبيث"]),
+    ("treatment", ["traitement", "soigner", "guérir", "guérison", "treatment", "therapy", "علاج"]),
+]
+_classify_fallback = build_category_classifier([keywords for _, keywords in FALLBACK_CATEGORIES])
+
 def get_fallback_responses(query: str, language: str) -> str:
     """
     Fournit des réponses prédéfinies basées sur la catégorie de la question.
@@ -243,30 +469,22 @@ def get_fallback_responses(query: str, language: str) -> str:
     if language not in responses:
         language = "fr"
     
-    # Logique simple pour déterminer la catégorie de la question
-    query_lower = query.lower()
-    
     # Déterminer la catégorie de la question
-    if any(word in query_lower for word in ["cancer", "sein", "mammaire", "breast", "سرطان", "ثدي"]):
-        return responses[language]["cancer_info"]
-    elif any(word in query_lower for word in ["bénin", "benin", "bénigne", "benign", "حميد"]):
-        return responses[language]["benign_info"]
-    elif any(word in query_lower for word in ["malin", "maligne", "malignes", "malignant", "خبيث"]):
-        return responses[language]["malignant_info"]
-    elif any(word in query_lower for word in ["traitement", "soigner", "guérir", "guérison", "treatment", "therapy", "علاج"]):
-        return responses[language]["treatment"]
-    else:
+    rank = _classify_fallback(query.lower())
+    if rank is None:
         return responses[language]["default"]
+    return responses[language][FALLBACK_CATEGORIES[rank][0]]
 
-def get_bot_response(question: str, llama_model, knowledge_base: str, detected_condition=None) -> str:
+def get_bot_response(question: str, llama_model, knowledge_base: str, detected_condition=None, streaming_callback=None) -> str:
     """
     Obtient une réponse du chatbot en fonction de la question.
     
     Args:
         question (str): Question de l'utilisateur
-        llama_model (Llama): Modèle LLama (ou None)
+        llama_model (LlamaPool): Contextes LLama (ou None)
         knowledge_base (str): Base de connaissances
         detected_condition (str, optional): Condition détectée dans l'image
+        streaming_callback (optional): Gestionnaire de streaming pour la génération LLama
         
     Returns:
         str: Réponse du chatbot
@@ -300,7 +518,7 @@ def get_bot_response(question: str, llama_model, knowledge_base: str, detected_c
     
     # 5. Utiliser le modèle LLama si disponible
     if llama_model:
-        return get_llama_response(llama_model, question, knowledge_base)
+        return get_llama_response(llama_model, question, knowledge_base, streaming_callback)
     
     # 6. Utiliser les réponses prédéfinies comme solution de repli
     return get_fallback_responses(question, language)
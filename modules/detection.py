@@ -1,10 +1,13 @@
 import streamlit as st
 import torch
+import numpy as np
 from ultralytics import YOLO
 from PIL import Image
+import os
+import hashlib
 import uuid
 import time
-from config import MALIGNANCY_THRESHOLD
+from config import MALIGNANCY_THRESHOLD, YOLO_IMGSZ, YOLO_EXPORT_FORMAT
 
 # Importation conditionnelle pour éviter les erreurs circulaires
 try:
@@ -12,6 +15,51 @@ try:
 except ImportError:
     callback_manager = None
 
+# Périphérique utilisé pour le prétraitement et l'inférence YOLO
+DEVICE = "cuda:0" if torch.cuda.is_available() else "cpu"
+# Demi-précision (fp16) sur GPU uniquement
+HALF_PRECISION = DEVICE != "cpu"
+
+def exported_model_path(model_path, export_format):
+    """
+    Renvoie le chemin du modèle exporté produit par Ultralytics.
+    
+    Args:
+        model_path (str): Chemin du modèle PyTorch
+        export_format (str): Format d'export ("onnx" ou "openvino")
+        
+    Returns:
+        str: Chemin du fichier (ou dossier) exporté
+    """
+    base, _ = os.path.splitext(model_path)
+    if export_format == "openvino":
+        return f"{base}_openvino_model"
+    return f"{base}.{export_format}"
+
+def load_exported_model(model, model_path):
+    """
+    Charge la version exportée du modèle YOLO, en l'exportant au premier lancement.
+    
+    Args:
+        model (YOLO): Modèle PyTorch chargé
+        model_path (str): Chemin du modèle PyTorch
+        
+    Returns:
+        YOLO: Modèle exporté, ou le modèle PyTorch si l'export échoue
+    """
+    try:
+        export_path = exported_model_path(model_path, YOLO_EXPORT_FORMAT)
+        if not os.path.exists(export_path):
+            export_path = model.export(
+                format=YOLO_EXPORT_FORMAT,
+                imgsz=YOLO_IMGSZ,
+                half=(YOLO_EXPORT_FORMAT == "openvino")  # Poids compressés en fp16 pour OpenVINO
+            )
+        return YOLO(export_path, task="detect")
+    except Exception as e:
+        st.warning(f"Export YOLO ({YOLO_EXPORT_FORMAT}) impossible, utilisation du modèle PyTorch: {e}")
+        return model
+
 @st.cache_resource
 def load_model(model_path):
     """
@@ -25,6 +73,9 @@ def load_model(model_path):
     """
     try:
         model = YOLO(model_path)
+        # Sur CPU, utiliser si demandé un format d'inférence optimisé (ONNX Runtime, OpenVINO)
+        if YOLO_EXPORT_FORMAT and DEVICE == "cpu":
+            model = load_exported_model(model, model_path)
         return model
     except Exception as e:
         st.error(f"Erreur lors du chargement du modèle YOLO: {e}")
@@ -47,15 +98,23 @@ def predict_with_yolo(model, image, conf_threshold=0.25):
         if image.mode != "RGB":
             image = image.convert("RGB")
         
-        # Faire la prédiction
-        results = model.predict(image, conf=conf_threshold)
+        # Faire la prédiction (Ultralytics applique son letterbox puis ramène
+        # les boîtes aux dimensions de l'image d'origine, utilisée par res.plot())
+        results = model.predict(
+            image,
+            conf=conf_threshold,
+            device=DEVICE,
+            half=HALF_PRECISION,
+            imgsz=YOLO_IMGSZ,
+            verbose=False
+        )
         
         # Déclencher un callback pour la prédiction
         if callback_manager and len(results) > 0 and len(results[0].boxes) > 0:
             callback_manager.trigger(
                 "on_detection",
                 detection_count=len(results[0].boxes),
-                confidence_scores=[float(box.conf[0]) for box in results[0].boxes],
+                confidence_scores=results[0].boxes.conf.detach().cpu().numpy().tolist(),
                 prediction_time=time.time(),
                 threshold_used=conf_threshold
             )
@@ -73,6 +132,63 @@ def predict_with_yolo(model, image, conf_threshold=0.25):
             )
         return None
 
+def image_digest(image):
+    """
+    Calcule l'empreinte du contenu d'une image.
+    
+    Args:
+        image (PIL.Image): Image à identifier
+        
+    Returns:
+        str: Empreinte hexadécimale (mode, taille et pixels)
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{image.mode}:{image.size}".encode("utf-8"))
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+@st.cache_resource(show_spinner=False, max_entries=16)
+def _predict_cached(_model, _image, digest, conf_threshold):
+    """Prédiction mise en cache par empreinte d'image et seuil (les échecs ne sont pas conservés)."""
+    results = predict_with_yolo(_model, _image, conf_threshold)
+    if results is None:
+        raise RuntimeError("Prédiction YOLO impossible")
+    return results
+
+def predict_with_yolo_cached(model, image, conf_threshold=0.25):
+    """
+    Effectue une prédiction YOLO en réutilisant le résultat d'une même image.
+    
+    Streamlit réexécute le script à chaque interaction: tant que l'image
+    reste chargée, ses résultats sont relus au lieu d'être recalculés.
+    
+    Args:
+        model (YOLO): Modèle YOLO
+        image (PIL.Image): Image à analyser
+        conf_threshold (float): Seuil de confiance
+        
+    Returns:
+        list: Résultats de la prédiction ou None en cas d'erreur
+    """
+    try:
+        return _predict_cached(model, image, image_digest(image), conf_threshold)
+    except RuntimeError:
+        return None
+
+def get_highest_confidence(boxes):
+    """
+    Renvoie la détection la plus confiante à partir d'une seule copie des scores.
+    
+    Args:
+        boxes (ultralytics.engine.results.Boxes): Boîtes détectées (non vides)
+        
+    Returns:
+        tuple: (indice de la détection, score de confiance)
+    """
+    confidences = boxes.conf.detach().cpu().numpy()
+    highest_conf_idx = int(confidences.argmax())
+    return highest_conf_idx, float(confidences[highest_conf_idx])
+
 def display_results(yolo_results, image):
     """
     Affiche les résultats de l'analyse YOLO.
@@ -83,6 +199,9 @@ def display_results(yolo_results, image):
     """
     st.subheader("Résultats de l'analyse")
     
+    # Confiance de la meilleure détection (None si aucune détection)
+    highest_conf = None
+    
     # Générer un ID unique pour cette analyse
     analysis_id = f"analysis_{uuid.uuid4().hex[:8]}"
     
@@ -102,29 +221,29 @@ def display_results(yolo_results, image):
             annotated_img = res.plot()
             st.image(annotated_img, caption="Image avec détections", use_container_width=True)
             
-            # Variables pour les statistiques
-            malignant_count = 0
-            benign_count = 0
-            all_confidences = []
+            # Scores et classes de toutes les détections, copiés en une seule fois
+            # (en float64, comme les float Python utilisés pour les comparaisons)
+            confidences = boxes.conf.detach().cpu().numpy().astype(np.float64)
+            classes = boxes.cls.detach().cpu().numpy().astype(int)
+            
+            # Statistiques calculées sur l'ensemble des détections
+            malignant_mask = confidences > MALIGNANCY_THRESHOLD
+            malignant_count = int(malignant_mask.sum())
+            benign_count = len(confidences) - malignant_count
             
             # Afficher les détails des détections
-            for i, box in enumerate(boxes):
-                cls = int(box.cls[0])
-                conf = float(box.conf[0])
+            for i, (cls, conf, is_malignant) in enumerate(zip(classes.tolist(), confidences.tolist(), malignant_mask.tolist())):
                 original_class_name = res.names[cls]
-                all_confidences.append(conf)
                 
                 # Classification basée sur le seuil de confiance
-                if conf > MALIGNANCY_THRESHOLD:
+                if is_malignant:
                     adjusted_class_name = "cancer"  # Malin
                     display_name = "MALIGNE"
                     color = "🔴"
-                    malignant_count += 1
                 else:
                     adjusted_class_name = "normal"  # Bénin
                     display_name = "BÉNIGNE"
                     color = "🟢"
-                    benign_count += 1
                 
                 st.write(f"{color} Détection {i+1}: Tumeur {display_name} (Confiance: {conf:.2f})")
                 
@@ -143,12 +262,11 @@ def display_results(yolo_results, image):
                         confidence=conf,
                         original_class=original_class_name,
                         adjusted_class=adjusted_class_name,
-                        is_malignant=(conf > MALIGNANCY_THRESHOLD)
+                        is_malignant=is_malignant
                     )
             
             # Stocker la condition détectée pour le chatbot basée sur la détection avec la plus haute confiance
-            highest_conf_idx = torch.argmax(boxes.conf).item()
-            highest_conf = float(boxes.conf[highest_conf_idx])
+            highest_conf = float(confidences.max())
             
             # Utiliser le seuil pour déterminer la classification finale
             if highest_conf > MALIGNANCY_THRESHOLD:
@@ -164,7 +282,7 @@ def display_results(yolo_results, image):
                     total_detections=len(boxes),
                     malignant_count=malignant_count,
                     benign_count=benign_count,
-                    average_confidence=sum(all_confidences) / len(all_confidences) if all_confidences else 0,
+                    average_confidence=float(confidences.mean()),
                     highest_confidence=highest_conf,
                     final_classification=st.session_state.detected_condition
                 )
@@ -196,12 +314,7 @@ def display_results(yolo_results, image):
     # Afficher une conclusion
     st.subheader("Conclusion")
     
-    if yolo_results and len(yolo_results) > 0 and len(yolo_results[0].boxes) > 0:
-        # Extraire les résultats de YOLO pour la conclusion
-        boxes = yolo_results[0].boxes
-        highest_conf_idx = torch.argmax(boxes.conf).item()
-        highest_conf = float(boxes.conf[highest_conf_idx])
-        
+    if highest_conf is not None:
         # Utiliser le seuil pour la conclusion finale
         if highest_conf > MALIGNANCY_THRESHOLD:
             st.error("⚠️ Le modèle détecte une tumeur MALIGNE avec une confiance de {:.1f}%. Caractéristiques possibles: masse irrégulière avec spicules. Veuillez consulter un médecin rapidement.".format(highest_conf * 100))
@@ -1,68 +1,397 @@
-import streamlit as st
-import PyPDF2
 import urllib.request
+import urllib.error
 from bs4 import BeautifulSoup
 import re
+import bisect
+import asyncio
+import functools
+import os
+import gzip
+import pickle
+import hashlib
+import logging
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from config import KB_CACHE_DIR, KB_URL_MAX_AGE
+from modules.utils import compile_keywords, build_category_classifier
+from modules.callbacks import on_error_occurred
+# Module sans effet de bord à l'import, seul chargé par les processus de travail
+from modules.pdf_text import read_pdf_text
+
+# Ces fonctions s'exécutent aussi dans le thread de construction de la base de
+# connaissances, sans contexte Streamlit: les erreurs sont journalisées et
+# signalées par callback plutôt qu'affichées avec st.error / st.warning
+logger = logging.getLogger(__name__)
+
+# Analyseur HTML: lxml (en C) s'il est installé, sinon l'analyseur intégré de Python
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+# Nombre maximal de téléchargements simultanés
+MAX_CONCURRENT_FETCHES = 8
+
+# Taille maximale (en caractères) de l'extrait de connaissances transmis au modèle
+MAX_KNOWLEDGE_CHARS = 1500
+
+def _pdf_cache_key(pdf_path):
+    """Clé de cache d'un PDF: chemin, date de modification et taille du fichier."""
+    stat = os.stat(pdf_path)
+    return _cache_key("pdf", pdf_path, stat.st_mtime_ns, stat.st_size)
 
-@st.cache_data
 def extract_text_from_pdfs(pdf_paths):
     """
     Extrait le texte de plusieurs fichiers PDF.
     
+    Le texte de chaque fichier est conservé dans le cache disque (un PDF
+    modifié est automatiquement ré-extrait). Les fichiers absents du cache
+    sont analysés en parallèle dans des processus séparés, PyPDF2 étant
+    écrit en Python pur et ne libérant pas le GIL.
+    
     Args:
         pdf_paths (list): Liste des chemins vers les fichiers PDF
         
     Returns:
         str: Texte extrait des PDFs
     """
-    all_text = ""
+    texts = {}
+    keys = {}
     for pdf_path in pdf_paths:
         try:
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                for page_num in range(len(pdf_reader.pages)):
-                    page = pdf_reader.pages[page_num]
-                    all_text += page.extract_text() + "\n\n"
+            keys[pdf_path] = _pdf_cache_key(pdf_path)
+        except OSError as e:
+            logger.error(f"Erreur lors de la lecture du PDF {pdf_path}: {e}")
+            on_error_occurred("knowledge_extraction_error", str(e), "knowledge_pdf")
+            continue
+        cached = load_from_disk_cache(keys[pdf_path])
+        if cached is not None:
+            texts[pdf_path] = cached
+    
+    missing = [pdf_path for pdf_path in keys if pdf_path not in texts]
+    if len(missing) > 1:
+        # Processus lancés par "spawn": l'application utilise déjà plusieurs threads
+        workers = min(len(missing), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = {pdf_path: executor.submit(read_pdf_text, pdf_path) for pdf_path in missing}
+    else:
+        futures = {}
+    
+    for pdf_path in missing:
+        try:
+            text = futures[pdf_path].result() if futures else read_pdf_text(pdf_path)
         except Exception as e:
-            st.error(f"Erreur lors de la lecture du PDF {pdf_path}: {e}")
-    return all_text
+            logger.error(f"Erreur lors de la lecture du PDF {pdf_path}: {e}")
+            on_error_occurred("knowledge_extraction_error", str(e), "knowledge_pdf")
+            continue
+        texts[pdf_path] = text
+        if text:
+            save_to_disk_cache(keys[pdf_path], text)
+    
+    return "".join(texts.get(pdf_path, "") for pdf_path in pdf_paths)
+
+# Coupure de fragment de texte: fin de ligne (au sens de str.splitlines) ou double espace,
+# avec les blancs qui l'entourent
+_TEXT_BREAK_RE = re.compile(r"\s*(?:[\n\r\x0b\x0c\x1c-\x1e\x85\u2028\u2029]| {2})\s*")
+
+def html_to_text(html):
+    """
+    Extrait le texte lisible d'une page HTML.
+    
+    Args:
+        html (bytes | str): Contenu HTML
+        
+    Returns:
+        str: Texte nettoyé de la page
+    """
+    soup = BeautifulSoup(html, HTML_PARSER)
+    # Suppression des scripts et styles
+    for script in soup(["script", "style"]):
+        script.extract()
+    
+    # Extraction du texte
+    text = soup.get_text()
+    
+    # Nettoyage du texte: une ligne par fragment, en un seul passage
+    return _TEXT_BREAK_RE.sub("\n", text).strip()
 
-@st.cache_data
-def extract_text_from_urls(urls):
+async def _fetch_all(urls):
     """
-    Extrait le texte de plusieurs URLs.
+    Télécharge et extrait toutes les URLs en parallèle.
+    
+    Args:
+        urls (list): URLs à télécharger
+        
+    Returns:
+        list: Texte de chaque page, ou l'exception levée pour cette URL
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_FETCHES)
+    
+    async def fetch(url):
+        async with semaphore:
+            return await asyncio.to_thread(load_url_text_cached, url)
+    
+    return await asyncio.gather(*(fetch(url) for url in urls), return_exceptions=True)
+
+def fetch_urls_text(urls):
+    """
+    Récupère le texte de plusieurs URLs en parallèle.
     
     Args:
         urls (list): Liste des URLs
         
     Returns:
-        str: Texte extrait des URLs
+        list: Texte de chaque page, ou l'exception levée pour cette URL
     """
-    all_text = ""
-    for url in urls:
-        try:
-            headers = {'User-Agent': 'Mozilla/5.0'}
-            req = urllib.request.Request(url, headers=headers)
-            response = urllib.request.urlopen(req)
+    return asyncio.run(_fetch_all(urls))
+
+def _cache_file(key):
+    """Chemin du fichier de cache disque associé à une clé."""
+    return os.path.join(KB_CACHE_DIR, f"{key}.pkl.gz")
+
+def _cache_key(*parts):
+    """Calcule une clé de cache stable à partir des éléments fournis."""
+    return hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=16).hexdigest()
+
+def load_from_disk_cache(key):
+    """
+    Lit une entrée du cache disque.
+    
+    Args:
+        key (str): Clé de l'entrée
+        
+    Returns:
+        object: Valeur en cache ou None si absente ou illisible
+    """
+    try:
+        with gzip.open(_cache_file(key), 'rb') as f:
+            return pickle.load(f)
+    except Exception:
+        return None
+
+def save_to_disk_cache(key, value):
+    """
+    Écrit une entrée dans le cache disque (écriture atomique).
+    
+    Args:
+        key (str): Clé de l'entrée
+        value (object): Valeur sérialisable à stocker
+    """
+    try:
+        os.makedirs(KB_CACHE_DIR, exist_ok=True)
+        tmp_path = _cache_file(key) + ".tmp"
+        with gzip.open(tmp_path, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, _cache_file(key))
+    except Exception as e:
+        logger.warning(f"Impossible d'écrire le cache {key}: {e}")
+        on_error_occurred("cache_write_error", str(e), "knowledge")
+
+def load_url_text_cached(url):
+    """
+    Récupère le texte d'une URL en s'appuyant sur le cache disque.
+    
+    Le texte extrait est toujours conservé, avec sa date de récupération.
+    Pendant KB_URL_MAX_AGE secondes, il est réutilisé sans requête; ensuite,
+    les en-têtes ETag / Last-Modified de la dernière réponse sont renvoyés au
+    serveur et une réponse 304 réutilise le texte sans le re-parser. Si la
+    page ne peut pas être récupérée, le texte en cache est renvoyé.
+    
+    Args:
+        url (str): URL à extraire
+        
+    Returns:
+        str: Texte extrait de la page
+    """
+    key = _cache_key("url", url)
+    cached = load_from_disk_cache(key)
+    
+    if cached and time.time() - cached.get("fetched_at", 0) < KB_URL_MAX_AGE:
+        return cached["text"]
+    
+    headers = {'User-Agent': 'Mozilla/5.0'}
+    if cached:
+        if cached.get("etag"):
+            headers['If-None-Match'] = cached["etag"]
+        if cached.get("last_modified"):
+            headers['If-Modified-Since'] = cached["last_modified"]
+    
+    req = urllib.request.Request(url, headers=headers)
+    try:
+        with urllib.request.urlopen(req) as response:
             html = response.read()
-            
-            soup = BeautifulSoup(html, 'html.parser')
-            # Suppression des scripts et styles
-            for script in soup(["script", "style"]):
-                script.extract()
-            
-            # Extraction du texte
-            text = soup.get_text()
-            
-            # Nettoyage du texte
-            lines = (line.strip() for line in text.splitlines())
-            chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-            text = '\n'.join(chunk for chunk in chunks if chunk)
-            
-            all_text += text + "\n\n"
-        except Exception as e:
-            st.error(f"Erreur lors de l'extraction du texte depuis {url}: {e}")
-    return all_text
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+    except urllib.error.HTTPError as e:
+        if not cached:
+            raise
+        if e.code == 304:
+            # Contenu inchangé: le texte en cache est de nouveau à jour
+            save_to_disk_cache(key, dict(cached, fetched_at=time.time()))
+        else:
+            logger.warning(f"Récupération de {url} impossible ({e}), texte en cache utilisé")
+        return cached["text"]
+    except OSError as e:
+        # Hors ligne, délai dépassé, etc.: le texte déjà extrait reste utilisable
+        if not cached:
+            raise
+        logger.warning(f"Récupération de {url} impossible ({e}), texte en cache utilisé")
+        return cached["text"]
+    
+    text = html_to_text(html)
+    save_to_disk_cache(key, {
+        "etag": etag,
+        "last_modified": last_modified,
+        "fetched_at": time.time(),
+        "text": text,
+    })
+    return text
+
+# Catégories de questions par langue, par ordre de priorité:
+# (mots déclencheurs dans la requête, mots clés recherchés dans la base)
+KNOWLEDGE_CATEGORIES = {
+    "fr": [
+        (["symptome", "symptôme", "signe"], ["symptôme", "signe", "caractéristique", "manifestation", "indication"]),
+        (["traitement", "soigner", "guérir"], ["traitement", "thérapie", "soin", "guérison", "chirurgie", "radiothérapie", "chimiothérapie"]),
+        (["risque", "facteur", "prévention"], ["risque", "facteur", "prévention", "dépistage", "prédisposition"]),
+        (["diagnostic", "détection", "test"], ["diagnostic", "détection", "test", "examen", "mammographie", "biopsie"]),
+    ],
+    "en": [
+        (["symptom", "sign"], ["symptom", "sign", "characteristic", "manifestation", "indication"]),
+        (["treatment", "cure", "heal"], ["treatment", "therapy", "care", "healing", "surgery", "radiation", "chemotherapy"]),
+        (["risk", "factor", "prevention"], ["risk", "factor", "prevention", "screening", "predisposition"]),
+        (["diagnosis", "detection", "test"], ["diagnosis", "detection", "test", "examination", "mammography", "biopsy"]),
+    ],
+    "ar": [
+        (["عرض", "علامة", "أعراض"], ["عرض", "علامة", "خصائص", "أعراض", "مؤشر"]),
+        (["علاج", "شفاء"], ["علاج", "شفاء", "رعاية", "جراحة", "إشعاع", "كيماوي"]),
+        (["خطر", "عامل", "وقاية"], ["خطر", "عامل", "وقاية", "فحص", "استعداد"]),
+        (["تشخيص", "كشف", "فحص"], ["تشخيص", "كشف", "فحص", "تصوير", "خزعة"]),
+    ],
+}
+
+# Mots généraux sur le cancer du sein, utilisés si aucune catégorie n'est reconnue
+GENERAL_KNOWLEDGE_KEYWORDS = {
+    "fr": ["cancer", "sein", "tumeur", "maligne", "bénigne"],
+    "en": ["cancer", "breast", "tumor", "malignant", "benign"],
+    "ar": ["سرطان", "ثدي", "ورم", "خبيث", "حميد"],
+}
+
+# Fonction de classement des requêtes, spécialisée pour chaque langue
+_KNOWLEDGE_CLASSIFIERS = {
+    language: build_category_classifier([triggers for triggers, _ in categories])
+    for language, categories in KNOWLEDGE_CATEGORIES.items()
+}
+
+@functools.lru_cache(maxsize=4)
+def index_knowledge_base(knowledge_base):
+    """
+    Découpe la base de connaissances en paragraphes et prépare leur recherche.
+    
+    Les paragraphes en minuscules sont réunis en un seul texte, séparés par
+    une ligne vide (aucun mot clé ne contient de saut de ligne, une
+    correspondance ne peut donc pas chevaucher deux paragraphes), avec la
+    position de début de chacun. Le résultat est conservé pour les requêtes
+    suivantes sur la même base.
+    
+    Args:
+        knowledge_base (str): Base de connaissances complète
+        
+    Returns:
+        tuple: (paragraphes d'origine, texte en minuscules, positions de début)
+    """
+    paragraphs = tuple(re.split(r'\n\s*\n', knowledge_base))
+    # Chaque paragraphe n'est mis en minuscules qu'une seule fois (sa longueur
+    # peut différer de l'original, les positions sont donc calculées sur cette version)
+    paragraphs_lower = [paragraph.lower() for paragraph in paragraphs]
+    starts = []
+    position = 0
+    for paragraph_lower in paragraphs_lower:
+        starts.append(position)
+        position += len(paragraph_lower) + 2
+    text_lower = "\n\n".join(paragraphs_lower)
+    return paragraphs, text_lower, tuple(starts)
+
+def find_matching_paragraphs(pattern, text_lower, starts):
+    """
+    Produit les indices des paragraphes contenant une correspondance du motif.
+    
+    Le texte est parcouru en un seul passage; après une correspondance, la
+    recherche reprend au paragraphe suivant. Les indices sont produits à la
+    demande: l'appelant peut arrêter le parcours dès qu'il en a assez.
+    
+    Args:
+        pattern (re.Pattern): Motif des mots clés
+        text_lower (str): Paragraphes en minuscules réunis
+        starts (tuple): Position de début de chaque paragraphe
+        
+    Yields:
+        int: Indices des paragraphes correspondants, dans l'ordre
+    """
+    match = pattern.search(text_lower)
+    while match is not None:
+        index = bisect.bisect_right(starts, match.start()) - 1
+        yield index
+        if index + 1 >= len(starts):
+            break
+        match = pattern.search(text_lower, starts[index + 1])
+
+@functools.lru_cache(maxsize=32)
+def keywords_pattern(keywords):
+    """
+    Compile un ensemble de mots clés en un seul motif de recherche.
+    
+    Args:
+        keywords (tuple): Mots clés recherchés
+        
+    Returns:
+        re.Pattern: Motif compilé
+    """
+    return compile_keywords(keywords)
+
+@functools.lru_cache(maxsize=64)
+def knowledge_excerpt(keywords, knowledge_base):
+    """
+    Réunit les paragraphes de la base de connaissances contenant un des mots clés.
+    
+    Le résultat est mis en cache par catégorie de mots clés: des questions
+    différentes d'une même catégorie partagent le même extrait. Le hachage
+    d'une chaîne étant mémorisé par Python, la base de connaissances elle-même
+    sert de clé, sans coût de copie.
+    
+    Args:
+        keywords (tuple): Mots clés recherchés
+        knowledge_base (str): Base de connaissances complète
+        
+    Returns:
+        str: Extrait de la base de connaissances
+    """
+    # Paragraphes de la base de connaissances, découpés et mis en minuscules une seule fois
+    paragraphs, text_lower, starts = index_knowledge_base(knowledge_base)
+    
+    # Sélectionner les paragraphes contenant au moins un mot clé, en un seul passage,
+    # jusqu'à dépasser la taille maximale de l'extrait (la suite serait tronquée)
+    pattern = keywords_pattern(keywords)
+    relevant_segments = []
+    combined_length = -2
+    for index in find_matching_paragraphs(pattern, text_lower, starts):
+        relevant_segments.append(paragraphs[index])
+        combined_length += len(paragraphs[index]) + 2
+        if combined_length > MAX_KNOWLEDGE_CHARS:
+            break
+    
+    # Si aucun segment pertinent trouvé, prendre les 3 premiers paragraphes
+    if not relevant_segments and paragraphs:
+        relevant_segments = paragraphs[:3]
+    
+    # Limiter la taille totale des segments
+    combined_segments = "\n\n".join(relevant_segments)
+    if len(combined_segments) > MAX_KNOWLEDGE_CHARS:
+        return combined_segments[:MAX_KNOWLEDGE_CHARS] + "..."
+    
+    return combined_segments
 
 def extract_relevant_knowledge(query, knowledge_base, language):
     """
@@ -82,66 +411,17 @@ def extract_relevant_knowledge(query, knowledge_base, language):
     
     # Sinon, on extrait des segments pertinents basés sur des mots clés
     query_lower = query.lower()
-    relevant_segments = []
     
     # Identification des mots clés selon la langue
     keywords = []
-    
-    if language == "fr":
-        if any(word in query_lower for word in ["symptome", "symptôme", "signe"]):
-            keywords = ["symptôme", "signe", "caractéristique", "manifestation", "indication"]
-        elif any(word in query_lower for word in ["traitement", "soigner", "guérir"]):
-            keywords = ["traitement", "thérapie", "soin", "guérison", "chirurgie", "radiothérapie", "chimiothérapie"]
-        elif any(word in query_lower for word in ["risque", "facteur", "prévention"]):
-            keywords = ["risque", "facteur", "prévention", "dépistage", "prédisposition"]
-        elif any(word in query_lower for word in ["diagnostic", "détection", "test"]):
-            keywords = ["diagnostic", "détection", "test", "examen", "mammographie", "biopsie"]
-    elif language == "en":
-        if any(word in query_lower for word in ["symptom", "sign"]):
-            keywords = ["symptom", "sign", "characteristic", "manifestation", "indication"]
-        elif any(word in query_lower for word in ["treatment", "cure", "heal"]):
-            keywords = ["treatment", "therapy", "care", "healing", "surgery", "radiation", "chemotherapy"]
-        elif any(word in query_lower for word in ["risk", "factor", "prevention"]):
-            keywords = ["risk", "factor", "prevention", "screening", "predisposition"]
-        elif any(word in query_lower for word in ["diagnosis", "detection", "test"]):
-            keywords = ["diagnosis", "detection", "test", "examination", "mammography", "biopsy"]
-    elif language == "ar":
-        if any(word in query_lower for word in ["عرض", "علامة", "أعراض"]):
-            keywords = ["عرض", "علامة", "خصائص", "أعراض", "مؤشر"]
-        elif any(word in query_lower for word in ["علاج", "شفاء"]):
-            keywords = ["علاج", "شفاء", "رعاية", "جراحة", "إشعاع", "كيماوي"]
-        elif any(word in query_lower for word in ["خطر", "عامل", "وقاية"]):
-            keywords = ["خطر", "عامل", "وقاية", "فحص", "استعداد"]
-        elif any(word in query_lower for word in ["تشخيص", "كشف", "فحص"]):
-            keywords = ["تشخيص", "كشف", "فحص", "تصوير", "خزعة"]
+    classify = _KNOWLEDGE_CLASSIFIERS.get(language)
+    if classify is not None:
+        rank = classify(query_lower)
+        if rank is not None:
+            keywords = KNOWLEDGE_CATEGORIES[language][rank][1]
     
     # Si aucun mot clé spécifique, utiliser des mots généraux sur le cancer du sein
     if not keywords:
-        if language == "fr":
-            keywords = ["cancer", "sein", "tumeur", "maligne", "bénigne"]
-        elif language == "en":
-            keywords = ["cancer", "breast", "tumor", "malignant", "benign"]
-        elif language == "ar":
-            keywords = ["سرطان", "ثدي", "ورم", "خبيث", "حميد"]
-        else:
-            keywords = ["cancer", "sein", "breast", "tumor", "tumeur"]
-    
-    # Diviser la base de connaissances en paragraphes
-    paragraphs = re.split(r'\n\s*\n', knowledge_base)
-    
-    # Sélectionner les paragraphes contenant au moins un mot clé
-    for paragraph in paragraphs:
-        paragraph_lower = paragraph.lower()
-        if any(keyword in paragraph_lower for keyword in keywords):
-            relevant_segments.append(paragraph)
-    
-    # Si aucun segment pertinent trouvé, prendre les 3 premiers paragraphes
-    if not relevant_segments and paragraphs:
-        relevant_segments = paragraphs[:3]
+        keywords = GENERAL_KNOWLEDGE_KEYWORDS.get(language, ["cancer", "sein", "breast", "tumor", "tumeur"])
     
-    # Limiter la taille totale des segments
-    combined_segments = "\n\n".join(relevant_segments)
-    if len(combined_segments) > 1500:
-        return combined_segments[:1500] + "..."
-    
-    return combined_segments
+    return knowledge_excerpt(tuple(keywords), knowledge_base)
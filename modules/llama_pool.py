@@ -0,0 +1,68 @@
+"""
+Module de gestion des contextes LLama partagés entre les sessions.
+"""
+import queue
+from contextlib import contextmanager
+from typing import Any, List
+
+class LlamaPool:
+    """
+    Ensemble de contextes LLama chargés à partir du même modèle.
+
+    Les poids étant projetés en mémoire (mmap), les contextes partagent les
+    mêmes pages; chacun possède en revanche son propre cache KV, ce qui
+    permet de servir plusieurs sessions en parallèle.
+    """
+
+    def __init__(self, instances: List[Any]):
+        """
+        Initialise le pool.
+
+        Args:
+            instances: Contextes LLama (au moins un)
+        """
+        self.instances = list(instances)
+        self._available: "queue.Queue[Any]" = queue.Queue()
+        for instance in self.instances:
+            self._available.put(instance)
+
+    @property
+    def size(self) -> int:
+        """Nombre de contextes du pool."""
+        return len(self.instances)
+
+    def tokenize(self, text: str) -> List[int]:
+        """
+        Convertit un prompt en tokens, comme le fait create_completion.
+
+        Le vocabulaire étant commun à tous les contextes, le premier suffit.
+
+        Args:
+            text: Prompt à convertir
+
+        Returns:
+            list: Identifiants des tokens
+        """
+        return self.instances[0].tokenize(text.encode("utf-8"), special=True)
+
+    def n_ctx(self) -> int:
+        """Taille du contexte (en tokens) des contextes du pool."""
+        return self.instances[0].n_ctx()
+
+    @contextmanager
+    def acquire(self):
+        """
+        Réserve un contexte pour la durée du bloc `with`.
+
+        Un contexte n'est utilisé que par un seul thread à la fois (llama.cpp
+        n'est pas réentrant); si tous sont occupés, l'appel attend qu'un
+        contexte se libère.
+
+        Yields:
+            Llama: Contexte réservé
+        """
+        instance = self._available.get()
+        try:
+            yield instance
+        finally:
+            self._available.put(instance)
@@ -0,0 +1,24 @@
+"""
+Module d'extraction du texte des PDFs, exécuté aussi dans les processus de travail.
+
+Il n'importe que PyPDF2: un processus lancé par "spawn" qui l'importe ne
+configure ni la journalisation ni les callbacks de l'application.
+"""
+import PyPDF2
+
+def read_pdf_text(pdf_path):
+    """
+    Extrait le texte de toutes les pages d'un fichier PDF.
+    
+    Args:
+        pdf_path (str): Chemin vers le fichier PDF
+        
+    Returns:
+        str: Texte extrait du PDF
+    """
+    text = ""
+    with open(pdf_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        for page in pdf_reader.pages:
+            text += page.extract_text() + "\n\n"
+    return text
@@ -1,21 +1,225 @@
 import re
+import heapq
+import functools
+import itertools
 import langdetect
 from langdetect import detect
+from langdetect.lang_detect_exception import LangDetectException
+
+# Longueur du texte utilisée pour la détection de langue (et clé du cache)
+LANGUAGE_DETECTION_CHARS = 200
+
+@functools.lru_cache(maxsize=2048)
+def _detect_cached(text):
+    """
+    Détecte la langue d'un texte, avec mise en cache du résultat.
+    
+    Args:
+        text (str): Texte (déjà tronqué) à analyser
+        
+    Returns:
+        str: Code de langue détecté
+    """
+    try:
+        return langdetect.detect(text)
+    except LangDetectException:
+        return "fr"  # Par défaut, on retourne le français
 
 def detect_language(text):
     """
     Détecte la langue du texte fourni.
     
+    Seuls les premiers caractères sont analysés: ils suffisent à identifier
+    la langue, bornent la taille du cache et font qu'un même début de message
+    (par exemple le dernier message utilisateur réutilisé après une analyse
+    d'image) n'est analysé qu'une seule fois.
+    
     Args:
         text (str): Texte à analyser
         
     Returns:
         str: Code de langue détecté (fr, en, ar, etc.)
     """
-    try:
-        return langdetect.detect(text)
-    except:
-        return "fr"  # Par défaut, on retourne le français
+    return _detect_cached(text[:LANGUAGE_DETECTION_CHARS])
+
+def _alternation(patterns, flags=0):
+    """
+    Réunit plusieurs motifs en une seule expression régulière compilée.
+    
+    Le texte est ainsi parcouru une seule fois pour tout un groupe de motifs.
+    
+    Args:
+        patterns (tuple): Motifs à réunir
+        flags (int): Options de compilation
+        
+    Returns:
+        re.Pattern: Motif reconnaissant l'un quelconque des motifs
+    """
+    return re.compile('|'.join(f'(?:{pattern})' for pattern in patterns), flags)
+
+def _contains_any(text_lower, triggers):
+    """
+    Indique si l'un des fragments apparaît dans le texte (déjà en minuscules).
+    
+    Une recherche de sous-chaîne est bien moins coûteuse qu'un parcours du
+    texte par une expression régulière qui ne trouvera rien.
+    
+    Args:
+        text_lower (str): Texte en minuscules
+        triggers (tuple): Fragments recherchés
+        
+    Returns:
+        bool: True si au moins un fragment est présent
+    """
+    return any(trigger in text_lower for trigger in triggers)
+
+# Motifs de nettoyage des réponses LLama, compilés une seule fois (un motif par groupe).
+# Chaque groupe est accompagné de fragments en minuscules présents dans toute
+# correspondance: si aucun n'apparaît dans la réponse, le groupe est ignoré.
+
+# Instructions internes et formulations de question
+_INSTRUCTION_PATTERNS = tuple(re.compile(pattern, re.DOTALL | re.IGNORECASE) for pattern in (
+    r'INSTRUCTION (CRITIQUE|INTERNE|CRITICAL).*?Question:',
+    r'INTERNAL INSTRUCTION.*?Question:',
+    r'تعليمات (مهمة|داخلية).*?السؤال:',
+    r'Question corrigée et reformulée\s*:.*?\n',
+    r'Corrected and rephrased question\s*:.*?\n',
+    r'السؤال المصحح والمعاد صياغته\s*:.*?\n',
+))
+_INSTRUCTION_TRIGGERS = ("instruction", "تعليمات", "question corrigée", "corrected and rephrased", "السؤال المصحح")
+
+# Mentions à la correction
+_CORRECTION_PATTERNS = tuple(re.compile(pattern, re.IGNORECASE) for pattern in (
+    r'J\'ai corrigé et reformulé votre question\.',
+    r'I have corrected and rephrased your question\.',
+    r'لقد قمت بتصحيح وإعادة صياغة سؤالك\.',
+))
+_CORRECTION_TRIGGERS = ("j'ai corrigé", "i have corrected", "لقد قمت بتصحيح")
+
+# Balises HTML et formatage
+_HTML_TAG_RE = re.compile(r'<[^>]*>')
+# Caractères de formatage Markdown supprimés (table de traduction, sans expression régulière)
+_FORMATTING_TABLE = str.maketrans('', '', '*_~`|')
+
+# Termes médicaux erronés (à position égale, le terme listé en premier l'emporte;
+# "cellules moustacelles" est absent car "moustacelles" est déjà supprimé)
+_INCORRECT_TERMS_RE = re.compile('|'.join(re.escape(term) for term in (
+    "glandes salivaires", "cancéro-breast", "Léucodésques de Kallmann", "Mélancoloma",
+    "tissue mammary", "moustacelles", "cancérisation", "tumor anaplastique",
+    "lécithines", "anaplastique intraépithéliale", "tumors anaplastiques"
+)))
+
+# Analyse de pertinence des paragraphes
+_WORD_RE = re.compile(r'\b\w+\b')
+
+# Caractères ASCII ne pouvant pas faire partie d'un mot, remplacés par des espaces
+_ASCII_WORD_SEPARATORS = str.maketrans({
+    chr(codepoint): " " for codepoint in range(128)
+    if not (chr(codepoint).isalnum() or chr(codepoint) == "_")
+})
+
+def _words(text):
+    """
+    Découpe un texte en mots, comme re.findall(r'\\b\\w+\\b', text).
+    
+    Un texte ASCII (la plupart des réponses anglaises) est découpé par
+    str.translate et str.split, nettement plus rapides que le moteur
+    d'expressions régulières; les autres textes passent par le motif compilé.
+    
+    Args:
+        text (str): Texte à découper
+        
+    Returns:
+        list: Mots du texte
+    """
+    if text.isascii():
+        return text.translate(_ASCII_WORD_SEPARATORS).split()
+    return _WORD_RE.findall(text)
+
+_PARAGRAPH_SPLIT_RE = re.compile(r'\n\s*\n')
+# Marqueurs de politesse (recherche de sous-chaînes, sans moteur d'expressions régulières)
+_POLITENESS_MARKERS = ("n'hésitez pas", "je suis là", "en espérant", "j'espère", "pour toute question")
+
+# Formules de politesse et invitations
+_POLITENESS_FORMULA_RE = _alternation((
+    r'N\'hésitez[^\.\n]*?à me poser[^\.\n]*?\.',
+    r'Nous sommes là pour t\'aider[^\.\n]*?\.',
+    r'Si tu n\'obtiens pas[^\.\n]*?\.',
+    r'Vous pouvez aussi contacter[^\.\n]*?\.',
+    r'Si j\'avais des réponses[^\.\n]*?\.',
+    r'Je suis[^\.\n]*?à votre service[^\.\n]*?\.',
+    r'n\'hésitez pas à me poser[^\.\n]*?\.',
+    r'N\'hésitez pas à me demander[^\.\n]*?\.',
+    r'Je suis disponible[^\.\n]*?\.',
+    r'J\'espère que cette [^\.\n]*? vous a aidé[^\.\n]*?\.',
+    r'En espérant avoir répondu à votre question[^\.\n]*?\.',
+    r'Avez-vous d\'autres questions[^\.\n]*?\.',
+), re.IGNORECASE | re.DOTALL)
+_POLITENESS_FORMULA_TRIGGERS = (
+    "hésitez", "nous sommes là", "si tu n'obtiens pas", "vous pouvez aussi contacter",
+    "si j'avais des réponses", "à votre service", "je suis disponible", "vous a aidé",
+    "en espérant avoir", "avez-vous d'autres questions",
+)
+
+# Formules de conclusion
+# (appliquées l'une après l'autre: la fin de chaque formule dépend du texte
+# laissé par la suppression précédente)
+_CONCLUSION_PATTERNS = tuple(re.compile(pattern, re.IGNORECASE | re.DOTALL) for pattern in (
+    r'En résumé,[^\.]*?(?=\. [A-Z]|$)',
+    r'En conclusion,[^\.]*?(?=\. [A-Z]|$)',
+))
+_CONCLUSION_TRIGGERS = ("en résumé,", "en conclusion,")
+
+# Suggestions de consultations médicales
+_CONSULTATION_RE = _alternation((
+    r'Il est (donc |)important que vous consultiez un médecin[^\.]*?\.',
+    r'vous devriez consulter un médecin[^\.]*?\.',
+    r'consultez un professionnel de santé[^\.]*?\.',
+), re.IGNORECASE | re.DOTALL)
+_CONSULTATION_TRIGGERS = ("important que vous consultiez", "vous devriez consulter", "consultez un professionnel")
+
+# Mentions d'importance
+_IMPORTANCE_RE = _alternation((
+    r'Il est (aussi |également |)important de noter[^\.]*?\.',
+), re.IGNORECASE | re.DOTALL)
+_IMPORTANCE_TRIGGERS = ("important de noter",)
+
+# Mentions de complexité du sujet
+_COMPLEXITY_RE = _alternation((
+    r'il s\'agit (donc |)d\'un sujet (très |)vaste et complexe[^\.]*?\.',
+    r'Il n\'est pas possible dans ce contexte[^\.]*?\.',
+), re.IGNORECASE | re.DOTALL)
+_COMPLEXITY_TRIGGERS = ("vaste et complexe", "pas possible dans ce contexte")
+
+# Espaces et retours à la ligne répétés (un seul parcours pour les deux)
+_REPEATED_WHITESPACE_RE = re.compile(r'\n{3,}| {2,}')
+
+def _collapse_whitespace(match):
+    """Remplace une suite de retours à la ligne par deux, une suite d'espaces par un seul."""
+    return '\n\n' if match.group()[0] == '\n' else ' '
+
+# Préfixes standard
+_ANSWER_PREFIX_RE = re.compile(r'^(Réponse|Answer|إجابة)\s*:\s*', re.IGNORECASE)
+
+def score_paragraphs(match_counts, polite_flags):
+    """
+    Calcule le score de pertinence de paragraphes à partir de leurs caractéristiques.
+    
+    Le score ne dépend que de valeurs numériques (le découpage des textes est
+    fait en amont), ce qui permet de l'évaluer en une seule compréhension.
+    
+    Args:
+        match_counts (list): Nombre de mots-clés de la question présents dans chaque paragraphe
+        polite_flags (list): Présence de formules de politesse dans chaque paragraphe
+        
+    Returns:
+        list: Score de chaque paragraphe, dans l'ordre d'origine
+    """
+    return [
+        # Mots-clés, bonus pour les premiers paragraphes et pénalité de politesse
+        count * 2 + max(0, 3 - i) * 2 - (10 if polite else 0)
+        for i, (count, polite) in enumerate(zip(match_counts, polite_flags))
+    ]
 
 def clean_llama_response(answer, query=""):
     """
@@ -29,76 +233,61 @@ def clean_llama_response(answer, query=""):
     Returns:
         str: Réponse nettoyée et pertinente
     """
-    import re
-    
     if not answer or len(answer) < 10:
         return "Je ne peux pas générer une réponse complète pour le moment."
     
+    answer_lower = answer.lower()
+    
     # Suppression des instructions internes et des formulations de question
-    answer = re.sub(r'INSTRUCTION (CRITIQUE|INTERNE|CRITICAL).*?Question:', '', answer, flags=re.DOTALL | re.IGNORECASE)
-    answer = re.sub(r'INTERNAL INSTRUCTION.*?Question:', '', answer, flags=re.DOTALL | re.IGNORECASE)
-    answer = re.sub(r'تعليمات (مهمة|داخلية).*?السؤال:', '', answer, flags=re.DOTALL | re.IGNORECASE)
-    answer = re.sub(r'Question corrigée et reformulée\s*:.*?\n', '', answer, flags=re.DOTALL | re.IGNORECASE)
-    answer = re.sub(r'Corrected and rephrased question\s*:.*?\n', '', answer, flags=re.DOTALL | re.IGNORECASE)
-    answer = re.sub(r'السؤال المصحح والمعاد صياغته\s*:.*?\n', '', answer, flags=re.DOTALL | re.IGNORECASE)
+    if _contains_any(answer_lower, _INSTRUCTION_TRIGGERS):
+        for pattern in _INSTRUCTION_PATTERNS:
+            answer = pattern.sub('', answer)
     
     # Suppression des mentions à la correction
-    answer = re.sub(r'J\'ai corrigé et reformulé votre question\.', '', answer, flags=re.IGNORECASE)
-    answer = re.sub(r'I have corrected and rephrased your question\.', '', answer, flags=re.IGNORECASE)
-    answer = re.sub(r'لقد قمت بتصحيح وإعادة صياغة سؤالك\.', '', answer, flags=re.IGNORECASE)
+    if _contains_any(answer_lower, _CORRECTION_TRIGGERS):
+        for pattern in _CORRECTION_PATTERNS:
+            answer = pattern.sub('', answer)
     
     # Nettoyage des balises HTML et du formatage
-    answer = re.sub(r'<[^>]*>', '', answer)
-    answer = re.sub(r'[\*\_\~\`\|]+', '', answer)
+    answer = _HTML_TAG_RE.sub('', answer)
+    answer = answer.translate(_FORMATTING_TABLE)
     
     # Correction des termes médicaux erronés
-    incorrect_terms = [
-        "glandes salivaires", "cancéro-breast", "Léucodésques de Kallmann", "Mélancoloma",
-        "tissue mammary", "moustacelles", "cancérisation", "tumor anaplastique",
-        "lécithines", "cellules moustacelles", "anaplastique intraépithéliale",
-        "tumors anaplastiques"
-    ]
-    
-    for term in incorrect_terms:
-        answer = answer.replace(term, "")
+    answer = _INCORRECT_TERMS_RE.sub('', answer)
     
     # Extraction des mots-clés de la question pour l'analyse de pertinence
     if query:
         query_lower = query.lower()
-        question_words = set(re.findall(r'\b\w+\b', query_lower))
-        significant_words = {word for word in question_words if len(word) > 3}
+        question_words = set(_words(query_lower))
+        significant_words = frozenset(word for word in question_words if len(word) > 3)
         
         # Séparation en paragraphes
-        paragraphs = re.split(r'\n\s*\n', answer)
-        paragraphs = [p.strip() for p in paragraphs if len(p.strip()) > 20]
+        # (chaque paragraphe n'est épuré qu'une seule fois)
+        paragraphs = [p for p in (p.strip() for p in _PARAGRAPH_SPLIT_RE.split(answer)) if len(p) > 20]
         
-        # Évaluation de la pertinence de chaque paragraphe
-        scored_paragraphs = []
-        for i, para in enumerate(paragraphs):
+        # Caractéristiques de chaque paragraphe: mots-clés présents et formules de politesse
+        match_counts = []
+        polite_flags = []
+        for para in paragraphs:
             para_lower = para.lower()
             
-            # Calcul du score basé sur la présence de mots-clés
-            para_words = set(re.findall(r'\b\w+\b', para_lower))
-            word_match_score = len(para_words.intersection(significant_words)) * 2
+            # Nombre de mots-clés de la question présents
+            # (inutile de découper le paragraphe si la question n'a aucun mot significatif)
+            match_count = 0
+            if significant_words:
+                match_count = len(significant_words.intersection(_words(para_lower)))
+            match_counts.append(match_count)
             
-            # Bonus pour les paragraphes en position primaire (premier paragraphe)
-            position_score = max(0, 3 - i) * 2
-            
-            # Pénalité pour les formules de politesse et invitations
-            politeness_penalty = 0
-            if re.search(r'n\'hésitez pas|je suis là|en espérant|j\'espère|pour toute question', para_lower):
-                politeness_penalty = 10
-                
-            # Score final
-            total_score = word_match_score + position_score - politeness_penalty
-            scored_paragraphs.append((para, total_score))
+            # Présence de formules de politesse et invitations
+            polite_flags.append(any(marker in para_lower for marker in _POLITENESS_MARKERS))
         
-        # Tri des paragraphes par score et sélection des meilleurs
-        scored_paragraphs.sort(key=lambda x: x[1], reverse=True)
-        best_paragraphs = [p[0] for p in scored_paragraphs[:4]]  # Garder jusqu'à 4 paragraphes
+        # Évaluation de la pertinence et sélection des meilleurs paragraphes (jusqu'à 4)
+        scores = score_paragraphs(match_counts, polite_flags)
+        best_indices = heapq.nlargest(4, range(len(paragraphs)), key=scores.__getitem__)
         
         # Réorganisation des paragraphes dans leur ordre d'origine pour maintenir la cohérence
-        ordered_paragraphs = [p for p in paragraphs if p in best_paragraphs]
+        # (tri sur les indices plutôt que recherche de chaque paragraphe dans la sélection)
+        ordered_paragraphs = [paragraphs[i] for i in sorted(best_indices)]
         
         # Si aucun paragraphe n'est retenu, prendre le premier paragraphe
         if not ordered_paragraphs and paragraphs:
@@ -108,64 +297,60 @@ def clean_llama_response(answer, query=""):
         answer = "\n\n".join(ordered_paragraphs)
     
     # Nettoyage final
+    answer_lower = answer.lower()
     
     # Suppression des formules de politesse et invitations
-    answer = re.sub(r'N\'hésitez[^\.\n]*?à me poser[^\.\n]*?\.', '', answer, flags=re.IGNORECASE | re.DOTALL)
-    answer = re.sub(r'Nous sommes là pour t\'aider[^\.\n]*?\.', '', answer, flags=re.IGNORECASE | re.DOTALL) 
-    answer = re.sub(r'Si tu n\'obtiens pas[^\.\n]*?\.', '', answer, flags=re.IGNORECASE | re.DOTALL)
-    answer = re.sub(r'Vous pouvez aussi contacter[^\.\n]*?\.', '', answer, flags=re.IGNORECASE | re.DOTALL)
-    answer = re.sub(r'Si j\'avais des réponses[^\.\n]*?\.', '', answer, flags=re.IGNORECASE | re.DOTALL)
-    answer = re.sub(r'Je suis[^\.\n]*?à votre service[^\.\n]*?\.', '', answer, flags=re.IGNORECASE | re.DOTALL)
-    answer = re.sub(r'n\'hésitez pas à me poser[^\.\n]*?\.', '', answer, flags=re.IGNORECASE | re.DOTALL)
-    answer = re.sub(r'N\'hésitez pas à me demander[^\.\n]*?\.', '', answer, flags=re.IGNORECASE | re.DOTALL)
-    answer = re.sub(r'Je suis disponible[^\.\n]*?\.', '', answer, flags=re.IGNORECASE | re.DOTALL)
-    answer = re.sub(r'J\'espère que cette [^\.\n]*? vous a aidé[^\.\n]*?\.', '', answer, flags=re.IGNORECASE | re.DOTALL)
-    answer = re.sub(r'En espérant avoir répondu à votre question[^\.\n]*?\.', '', answer, flags=re.IGNORECASE | re.DOTALL)
-    answer = re.sub(r'Avez-vous d\'autres questions[^\.\n]*?\.', '', answer, flags=re.IGNORECASE | re.DOTALL)
+    if _contains_any(answer_lower, _POLITENESS_FORMULA_TRIGGERS):
+        answer = _POLITENESS_FORMULA_RE.sub('', answer)
     
     # Suppression des formules de conclusion
-    answer = re.sub(r'En résumé,[^\.]*?(?=\. [A-Z]|$)', '', answer, flags=re.IGNORECASE | re.DOTALL)
-    answer = re.sub(r'En conclusion,[^\.]*?(?=\. [A-Z]|$)', '', answer, flags=re.IGNORECASE | re.DOTALL)
+    if _contains_any(answer_lower, _CONCLUSION_TRIGGERS):
+        for pattern in _CONCLUSION_PATTERNS:
+            answer = pattern.sub('', answer)
     
     # Suppression des suggestions de consultations médicales
-    answer = re.sub(r'Il est (donc |)important que vous consultiez un médecin[^\.]*?\.', '', answer, flags=re.IGNORECASE | re.DOTALL)
-    answer = re.sub(r'vous devriez consulter un médecin[^\.]*?\.', '', answer, flags=re.IGNORECASE | re.DOTALL)
-    answer = re.sub(r'consultez un professionnel de santé[^\.]*?\.', '', answer, flags=re.IGNORECASE | re.DOTALL)
+    if _contains_any(answer_lower, _CONSULTATION_TRIGGERS):
+        answer = _CONSULTATION_RE.sub('', answer)
     
     # Suppression des mentions d'importance
-    answer = re.sub(r'Il est (aussi |également |)important de noter[^\.]*?\.', '', answer, flags=re.IGNORECASE | re.DOTALL)
+    if _contains_any(answer_lower, _IMPORTANCE_TRIGGERS):
+        answer = _IMPORTANCE_RE.sub('', answer)
     
     # Suppression des mentions de complexité du sujet
-    answer = re.sub(r'il s\'agit (donc |)d\'un sujet (très |)vaste et complexe[^\.]*?\.', '', answer, flags=re.IGNORECASE | re.DOTALL)
-    answer = re.sub(r'Il n\'est pas possible dans ce contexte[^\.]*?\.', '', answer, flags=re.IGNORECASE | re.DOTALL)
+    if _contains_any(answer_lower, _COMPLEXITY_TRIGGERS):
+        answer = _COMPLEXITY_RE.sub('', answer)
     
     # Nettoyage des espaces et retours à la ligne
-    answer = re.sub(r'\n{3,}', '\n\n', answer)
-    answer = re.sub(r' {2,}', ' ', answer)
+    answer = _REPEATED_WHITESPACE_RE.sub(_collapse_whitespace, answer)
     
     # Suppression des préfixes standard
-    answer = re.sub(r'^(Réponse|Answer|إجابة)\s*:\s*', '', answer, flags=re.IGNORECASE)
+    answer = _ANSWER_PREFIX_RE.sub('', answer)
     
     # Nettoyage final
     answer = answer.strip()
     
     return answer
 
-def generate_llama_prompt(query, language, knowledge_base="", use_correction=True):
+def preview_llama_response(answer):
     """
-    Génère un prompt pour obtenir une réponse détaillée mais strictement pertinente.
+    Nettoyage léger d'une réponse LLama en cours de génération.
+    
+    Reprend les étapes peu coûteuses de clean_llama_response (balises HTML,
+    formatage, préfixe "Réponse:"), afin que le texte affiché en streaming ne
+    change pas brusquement d'aspect une fois la réponse nettoyée.
     
     Args:
-        query (str): Requête de l'utilisateur
-        language (str): Code de langue détecté
-        knowledge_base (str, optional): Base de connaissances pertinente
-        use_correction (bool): Si True, inclut l'étape de correction de la requête
+        answer (str): Début de la réponse brute
         
     Returns:
-        str: Prompt formaté pour LLama
+        str: Texte à afficher
     """
-    if language == "fr":
-        system_message = """
+    answer = _HTML_TAG_RE.sub('', answer).translate(_FORMATTING_TABLE)
+    return _ANSWER_PREFIX_RE.sub('', answer.lstrip())
+
+# Messages système du prompt LLama, par langue
+_SYSTEM_MESSAGES = {
+    "fr": """
         Tu es un assistant médical spécialisé dans le cancer du sein. RÉPONDS UNIQUEMENT ET DIRECTEMENT À CE QUI EST DEMANDÉ dans la question. 
         Fournis une réponse détaillée, en utilisant plusieurs paragraphes si nécessaire pour bien expliquer chaque point, mais fais-le de manière structurée et claire. 
 
@@ -175,9 +360,8 @@ def generate_llama_prompt(query, language, knowledge_base="", use_correction=Tru
         Donne une réponse claire de maximum 10 lignes et qui convient à la question posée.
         Dans la réponse, tu dois uniquement répondre à la question posée, sans aborder d'autres sujets qui ne sont pas demandés. Réponds strictement à la question, ni plus ni moins.       
         Termine la phrase, ne t'arrête pas en cours de réponse.
-        """
-    elif language == "en":
-        system_message = """
+        """,
+    "en": """
         You are a medical assistant specializing in breast cancer. ANSWER ONLY AND DIRECTLY WHAT IS ASKED in the question. 
         Provide a detailed response, using multiple paragraphs when necessary to explain each point clearly and effectively. 
 
@@ -187,9 +371,8 @@ def generate_llama_prompt(query, language, knowledge_base="", use_correction=Tru
         Provide a clear response with a maximum of 10 lines that fits the question being asked.
         In your answer, you should only respond to the question being asked, without addressing any other topics. Respond strictly to the question, no more, no less.       
         Finish the sentence, do not stop halfway.
-        """
-    elif language == "ar":
-        system_message = """
+        """,
+    "ar": """
         أنت مساعد طبي متخصص في سرطان الثدي. أجب فقط ومباشرة على ما هو مطلوب في السؤال. 
         قدم إجابة مفصلة باستخدام عدة فقرات عند الحاجة لشرح كل نقطة بوضوح وفعالية. 
 
@@ -199,31 +382,14 @@ def generate_llama_prompt(query, language, knowledge_base="", use_correction=Tru
         قدم إجابة واضحة لا تتجاوز 10 أسطر تتناسب مع السؤال المطروح.
         في إجابتك، يجب أن تقتصر على الإجابة عن السؤال المطروح دون التطرق إلى مواضيع أخرى. أجب بدقة على السؤال، لا أكثر ولا أقل.       
         أكمل الجملة، لا تتوقف في منتصف الجواب.
-        """
-    else:
-        system_message = """
-        Tu es un assistant médical spécialisé dans le cancer du sein. RÉPONDS UNIQUEMENT ET DIRECTEMENT À CE QUI EST DEMANDÉ dans la question. 
-        Fournis une réponse détaillée, en utilisant plusieurs paragraphes si nécessaire pour bien expliquer chaque point, mais fais-le de manière structurée et claire. 
-
-        N'introduis PAS de définitions ou d'informations non demandées, et ne t'écarte pas du sujet précis de la question. 
-        Assure-toi que ta réponse est grammaticale, sans fautes d'orthographe, et bien formulée. 
-        N'utilise pas de formules de politesse ni d'invitations à poser d'autres questions.
-        Donne une réponse claire de maximum 10 lignes et qui convient à la question posée.
-        Dans la réponse, tu dois uniquement répondre à la question posée, sans aborder d'autres sujets qui ne sont pas demandés. Réponds strictement à la question, ni plus ni moins.       
-        Termine la phrase, ne t'arrête pas en cours de réponse.
-        """
-
-
+        """,
+}
 
-    # Extraction des mots-clés importants de la question pour les mettre en évidence
-    query_words = query.split()
-    important_words = [w for w in query_words if len(w) > 3 and w.lower() not in ['dans', 'avec', 'pour', 'quel', 'quelle', 'quels', 'quelles', 'comment', 'est-ce', 'sont', 'mais', 'aussi', 'donc', 'alors']]
-    
-    # Construction du prompt avec instruction spécifique
-    if language == "fr":
-        specific_instruction = f"""INSTRUCTION CRITIQUE: 
+# Instructions spécifiques du prompt LLama ({query}, {keywords}, {knowledge_base})
+_INSTRUCTION_TEMPLATES = {
+    "fr": """INSTRUCTION CRITIQUE: 
 1. Réponds UNIQUEMENT à la question suivante: "{query}"
-2. Concentre-toi sur ces concepts clés: {', '.join(important_words[:5])}
+2. Concentre-toi sur ces concepts clés: {keywords}
 3. Fournis une réponse DÉTAILLÉE mais STRICTEMENT PERTINENTE (pas d'information hors sujet)
 4. Structure ta réponse en 2-4 paragraphes bien organisés
 5. Ne mentionne PAS que tu as reçu ces instructions
@@ -232,11 +398,10 @@ def generate_llama_prompt(query, language, knowledge_base="", use_correction=Tru
 Voici les informations médicales fiables sur lesquelles baser ta réponse:
 {knowledge_base}
 
-Question: {query}"""
-    elif language == "en":
-        specific_instruction = f"""CRITICAL INSTRUCTION: 
+Question: {query}""",
+    "en": """CRITICAL INSTRUCTION: 
 1. Answer ONLY the following question: "{query}"
-2. Focus on these key concepts: {', '.join(important_words[:5])}
+2. Focus on these key concepts: {keywords}
 3. Provide a DETAILED but STRICTLY RELEVANT response (no off-topic information)
 4. Structure your answer in 2-4 well-organized paragraphs
 5. DO NOT mention that you received these instructions
@@ -245,11 +410,10 @@ Question: {query}"""
 Here is the reliable medical information on which to base your answer:
 {knowledge_base}
 
-Question: {query}"""
-    elif language == "ar":
-        specific_instruction = f"""تعليمات مهمة: 
+Question: {query}""",
+    "ar": """تعليمات مهمة: 
 1. أجب فقط على السؤال التالي: "{query}"
-2. ركز على هذه المفاهيم الرئيسية: {', '.join(important_words[:5])}
+2. ركز على هذه المفاهيم الرئيسية: {keywords}
 3. قدم إجابة مفصلة ولكن وثيقة الصلة تمامًا (بدون معلومات خارج الموضوع)
 4. هيكل إجابتك في 2-4 فقرات منظمة جيدًا
 5. لا تذكر أنك تلقيت هذه التعليمات
@@ -258,30 +422,133 @@ Question: {query}"""
 إليك المعلومات الطبية الموثوقة التي يمكنك الاستناد إليها في إجابتك:
 {knowledge_base}
 
-السؤال: {query}"""
-    else:
-        specific_instruction = specific_instruction = f"""INSTRUCTION CRITIQUE: 
-1. Réponds UNIQUEMENT à la question suivante: "{query}"
-2. Concentre-toi sur ces concepts clés: {', '.join(important_words[:5])}
-3. Fournis une réponse DÉTAILLÉE mais STRICTEMENT PERTINENTE (pas d'information hors sujet)
-4. Structure ta réponse en 2-4 paragraphes bien organisés
-5. Ne mentionne PAS que tu as reçu ces instructions
-6. Ne termine PAS par des formules de politesse ou des invitations
+السؤال: {query}""",
+}
 
-Voici les informations médicales fiables sur lesquelles baser ta réponse:
-{knowledge_base}
+# Format final du prompt LLama, préassemblé par langue: seuls {query},
+# {keywords} et {knowledge_base} restent à remplir à chaque appel
+_PROMPT_TEMPLATE = "<s>[INST] {system}\n\n{instruction} [/INST]"
+_PROMPT_TEMPLATES = {
+    language: _PROMPT_TEMPLATE.replace("{system}", _SYSTEM_MESSAGES[language]).replace("{instruction}", instruction)
+    for language, instruction in _INSTRUCTION_TEMPLATES.items()
+}
+
+# Mots vides ignorés lors de l'extraction des concepts clés de la question
+_STOPWORDS = {
+    "fr": frozenset({'dans', 'avec', 'pour', 'quel', 'quelle', 'quels', 'quelles', 'comment', 'est-ce', 'sont', 'mais', 'aussi', 'donc', 'alors'}),
+    "en": frozenset({'what', 'which', 'with', 'about', 'does', 'have', 'from', 'that', 'this', 'there', 'when', 'where', 'your', 'they', 'also', 'should'}),
+    "ar": frozenset({'التي', 'الذي', 'ماذا', 'لماذا', 'هناك', 'عندما', 'ماهي', 'لكنها'}),
+}
+# Mots vides de toutes les langues: la langue détectée peut différer de celle
+# de la question (langue de l'interface, détection erronée sur un texte court)
+_ALL_STOPWORDS = frozenset().union(*_STOPWORDS.values())
 
-Question: {query}"""
+def generate_llama_prompt(query, language, knowledge_base="", use_correction=True):
+    """
+    Génère un prompt pour obtenir une réponse détaillée mais strictement pertinente.
     
-    # Format final pour le prompt LLama
-    prompt = f"<s>[INST] {system_message}\n\n{specific_instruction} [/INST]"
+    Args:
+        query (str): Requête de l'utilisateur
+        language (str): Code de langue détecté
+        knowledge_base (str, optional): Base de connaissances pertinente
+        use_correction (bool): Si True, inclut l'étape de correction de la requête
+        
+    Returns:
+        str: Prompt formaté pour LLama
+    """
+    # Extraction des mots-clés importants de la question pour les mettre en évidence
+    # (seuls les 5 premiers sont utilisés: le filtrage s'arrête dès qu'ils sont trouvés)
+    important_words = list(itertools.islice(
+        (w for w in query.split() if len(w) > 3 and w.lower() not in _ALL_STOPWORDS),
+        5))
     
-    return prompt
+    # Construction du prompt complet (message système et instruction spécifique) en une seule fois
+    return _PROMPT_TEMPLATES.get(language, _PROMPT_TEMPLATES["fr"]).format_map({
+        "query": query,
+        "keywords": ', '.join(important_words),
+        "knowledge_base": knowledge_base,
+    })
+
+# Réponses de repli (une constante par langue et par sujet)
+_FB_FR_GREETING = "Bonjour! Je suis votre assistant spécialisé dans le cancer du sein. Comment puis-je vous aider aujourd'hui?"
+_FB_FR_THANKS = "Je vous en prie! N'hésitez pas si vous avez d'autres questions."
+_FB_FR_SYMPTOMS = "Les symptômes courants du cancer du sein incluent une bosse ou un épaississement dans le sein, un changement de taille ou de forme du sein, des modifications de la peau du sein (rougeur, fossettes), un écoulement du mamelon et une douleur dans le sein ou le mamelon. Il est important de consulter un médecin si vous remarquez l'un de ces signes."
+_FB_FR_TREATMENT = "Les traitements du cancer du sein peuvent inclure la chirurgie (tumorectomie ou mastectomie), la radiothérapie, la chimiothérapie, l'hormonothérapie et les thérapies ciblées. Le plan de traitement est personnalisé en fonction du stade du cancer, de son type et des caractéristiques de la patiente."
+_FB_FR_RISK = "Les facteurs de risque du cancer du sein incluent l'âge, les antécédents familiaux, les mutations génétiques (BRCA1 et BRCA2), l'exposition aux œstrogènes, le surpoids après la ménopause, la consommation d'alcool et l'inactivité physique. La prévention passe par un mode de vie sain et un dépistage régulier."
+_FB_FR_DEFAULT = "Je ne peux pas générer une réponse complète à cette question pour le moment. Je vous suggère de reformuler votre question ou de consulter un professionnel de santé pour obtenir des informations précises sur le cancer du sein."
+
+_FB_EN_GREETING = "Hello! I'm your breast cancer specialist assistant. How can I help you today?"
+_FB_EN_THANKS = "You're welcome! Feel free to ask if you have any other questions."
+_FB_EN_SYMPTOMS = "Common breast cancer symptoms include a lump or thickening in the breast, change in breast size or shape, changes to the skin of the breast (redness, dimpling), nipple discharge, and pain in the breast or nipple. It's important to consult a doctor if you notice any of these signs."
+_FB_EN_TREATMENT = "Breast cancer treatments may include surgery (lumpectomy or mastectomy), radiation therapy, chemotherapy, hormone therapy, and targeted therapies. The treatment plan is personalized based on the stage of cancer, its type, and the patient's characteristics."
+_FB_EN_RISK = "Breast cancer risk factors include age, family history, genetic mutations (BRCA1 and BRCA2), estrogen exposure, being overweight after menopause, alcohol consumption, and physical inactivity. Prevention involves a healthy lifestyle and regular screening."
+_FB_EN_DEFAULT = "I cannot generate a complete answer to this question at the moment. I suggest rephrasing your question or consulting a healthcare professional for accurate information about breast cancer."
+
+_FB_AR_GREETING = "مرحباً! أنا مساعدك المتخصص في سرطان الثدي. كيف يمكنني مساعدتك اليوم؟"
+_FB_AR_THANKS = "على الرحب والسعة! لا تتردد في السؤال إذا كان لديك أي استفسارات أخرى."
+_FB_AR_SYMPTOMS = "تشمل أعراض سرطان الثدي الشائعة وجود كتلة أو سماكة في الثدي، تغير في حجم أو شكل الثدي، تغيرات في جلد الثدي (احمرار، نقر)، إفرازات من الحلمة، وألم في الثدي أو الحلمة. من المهم استشارة الطبيب إذا لاحظت أياً من هذه العلامات."
+_FB_AR_TREATMENT = "قد تشمل علاجات سرطان الثدي الجراحة (استئصال الورم أو استئصال الثدي)، والعلاج الإشعاعي، والعلاج الكيميائي، والعلاج الهرموني، والعلاجات المستهدفة. يتم تخصيص خطة العلاج بناءً على مرحلة السرطان، ونوعه، وخصائص المريضة."
+_FB_AR_RISK = "تشمل عوامل خطر الإصابة بسرطان الثدي العمر، والتاريخ العائلي، والطفرات الجينية (BRCA1 و BRCA2)، والتعرض للإستروجين، وزيادة الوزن بعد انقطاع الطمث، واستهلاك الكحول، وقلة النشاط البدني. تتضمن الوقاية نمط حياة صحي وفحص منتظم."
+_FB_AR_DEFAULT = "لا يمكنني تقديم إجابة كاملة على هذا السؤال في الوقت الحالي. أقترح إعادة صياغة سؤالك أو استشارة أخصائي رعاية صحية للحصول على معلومات دقيقة حول سرطان الثدي."
+
+# Mots déclencheurs des réponses de repli
+_GREETINGS_FR = frozenset({"bonjour", "salut", "coucou"})
+_THANKS_FR = frozenset({"merci", "remercie", "remercier", "remerciements"})
+_SYMPTOM_WORDS_FR = frozenset({"symptome", "symptomes", "symptôme", "symptômes", "signe", "signes"})
+_TREATMENT_WORDS_FR = frozenset({"traitement", "traitements", "soigner", "guérir"})
+_RISK_WORDS_FR = frozenset({"risque", "risques", "facteur", "facteurs", "prévention"})
+
+_GREETINGS_EN = frozenset({"hello", "hi", "hey"})
+_THANKS_EN = frozenset({"thank", "thanks"})
+_SYMPTOM_WORDS_EN = frozenset({"symptom", "symptoms", "sign", "signs"})
+_TREATMENT_WORDS_EN = frozenset({"treatment", "treatments", "cure", "heal"})
+_RISK_WORDS_EN = frozenset({"risk", "risks", "factor", "factors", "prevention"})
+
+_GREETINGS_AR = frozenset({"صباح", "مرحبا", "سلام", "السلام", "أهلا"})
+_THANKS_AR = frozenset({"شكرا"})
+_SYMPTOM_WORDS_AR = frozenset({"عرض", "العرض", "علامة", "العلامة", "علامات", "العلامات", "أعراض", "الأعراض"})
+_TREATMENT_WORDS_AR = frozenset({"علاج", "العلاج", "شفاء", "الشفاء"})
+_RISK_WORDS_AR = frozenset({"خطر", "الخطر", "عامل", "العامل", "عوامل", "العوامل", "وقاية", "الوقاية"})
+
+# Mots d'un texte (lettres Unicode, y compris arabes, et chiffres)
+_WORD_TOKEN_RE = re.compile(r"\w+")
+
+# Règles de repli par langue: (mots déclencheurs, réponse), testées dans l'ordre
+_FALLBACK_TABLE = {
+    "fr": (
+        (_GREETINGS_FR, _FB_FR_GREETING),
+        (_THANKS_FR, _FB_FR_THANKS),
+        (_SYMPTOM_WORDS_FR, _FB_FR_SYMPTOMS),
+        (_TREATMENT_WORDS_FR, _FB_FR_TREATMENT),
+        (_RISK_WORDS_FR, _FB_FR_RISK),
+    ),
+    "en": (
+        (_GREETINGS_EN, _FB_EN_GREETING),
+        (_THANKS_EN, _FB_EN_THANKS),
+        (_SYMPTOM_WORDS_EN, _FB_EN_SYMPTOMS),
+        (_TREATMENT_WORDS_EN, _FB_EN_TREATMENT),
+        (_RISK_WORDS_EN, _FB_EN_RISK),
+    ),
+    "ar": (
+        (_GREETINGS_AR, _FB_AR_GREETING),
+        (_THANKS_AR, _FB_AR_THANKS),
+        (_SYMPTOM_WORDS_AR, _FB_AR_SYMPTOMS),
+        (_TREATMENT_WORDS_AR, _FB_AR_TREATMENT),
+        (_RISK_WORDS_AR, _FB_AR_RISK),
+    ),
+}
+
+# Réponses lorsque aucun mot déclencheur n'est présent
+_FALLBACK_DEFAULTS = {"fr": _FB_FR_DEFAULT, "en": _FB_EN_DEFAULT, "ar": _FB_AR_DEFAULT}
 
 def get_fallback_response(query, language):
     """
     Génère une réponse de repli basée sur des règles simples et la langue détectée.
     
+    La requête est découpée une seule fois en mots, comparés aux mots
+    déclencheurs de chaque règle (mots entiers: "merci" ne correspond pas à
+    "commerciale").
+    
     Args:
         query (str): Requête de l'utilisateur
         language (str): Code de langue détecté
@@ -289,53 +556,94 @@ def get_fallback_response(query, language):
     Returns:
         str: Réponse de repli
     """
-    query_lower = query.lower()
-    
-    # Réponses en français
-    if language == "fr":
-        if any(word in query_lower for word in ["bonjour", "salut", "coucou"]):
-            return "Bonjour! Je suis votre assistant spécialisé dans le cancer du sein. Comment puis-je vous aider aujourd'hui?"
-        elif any(word in query_lower for word in ["merci", "remercie"]):
-            return "Je vous en prie! N'hésitez pas si vous avez d'autres questions."
-        elif any(word in query_lower for word in ["symptome", "symptôme", "signe"]):
-            return "Les symptômes courants du cancer du sein incluent une bosse ou un épaississement dans le sein, un changement de taille ou de forme du sein, des modifications de la peau du sein (rougeur, fossettes), un écoulement du mamelon et une douleur dans le sein ou le mamelon. Il est important de consulter un médecin si vous remarquez l'un de ces signes."
-        elif any(word in query_lower for word in ["traitement", "soigner", "guérir"]):
-            return "Les traitements du cancer du sein peuvent inclure la chirurgie (tumorectomie ou mastectomie), la radiothérapie, la chimiothérapie, l'hormonothérapie et les thérapies ciblées. Le plan de traitement est personnalisé en fonction du stade du cancer, de son type et des caractéristiques de la patiente."
-        elif any(word in query_lower for word in ["risque", "facteur", "prévention"]):
-            return "Les facteurs de risque du cancer du sein incluent l'âge, les antécédents familiaux, les mutations génétiques (BRCA1 et BRCA2), l'exposition aux œstrogènes, le surpoids après la ménopause, la consommation d'alcool et l'inactivité physique. La prévention passe par un mode de vie sain et un dépistage régulier."
-        else:
-            return "Je ne peux pas générer une réponse complète à cette question pour le moment. Je vous suggère de reformuler votre question ou de consulter un professionnel de santé pour obtenir des informations précises sur le cancer du sein."
-    
-    # Réponses en anglais
-    elif language == "en":
-        if any(word in query_lower for word in ["hello", "hi", "hey"]):
-            return "Hello! I'm your breast cancer specialist assistant. How can I help you today?"
-        elif any(word in query_lower for word in ["thank", "thanks"]):
-            return "You're welcome! Feel free to ask if you have any other questions."
-        elif any(word in query_lower for word in ["symptom", "sign"]):
-            return "Common breast cancer symptoms include a lump or thickening in the breast, change in breast size or shape, changes to the skin of the breast (redness, dimpling), nipple discharge, and pain in the breast or nipple. It's important to consult a doctor if you notice any of these signs."
-        elif any(word in query_lower for word in ["treatment", "cure", "heal"]):
-            return "Breast cancer treatments may include surgery (lumpectomy or mastectomy), radiation therapy, chemotherapy, hormone therapy, and targeted therapies. The treatment plan is personalized based on the stage of cancer, its type, and the patient's characteristics."
-        elif any(word in query_lower for word in ["risk", "factor", "prevention"]):
-            return "Breast cancer risk factors include age, family history, genetic mutations (BRCA1 and BRCA2), estrogen exposure, being overweight after menopause, alcohol consumption, and physical inactivity. Prevention involves a healthy lifestyle and regular screening."
-        else:
-            return "I cannot generate a complete answer to this question at the moment. I suggest rephrasing your question or consulting a healthcare professional for accurate information about breast cancer."
-    
-    # Réponses en arabe
-    elif language == "ar":
-        if any(word in query_lower for word in ['صباح الخير ',"مرحبا", "سلام", "أهلا"]):
-            return "مرحباً! أنا مساعدك المتخصص في سرطان الثدي. كيف يمكنني مساعدتك اليوم؟"
-        elif any(word in query_lower for word in ["شكرا"]):
-            return "على الرحب والسعة! لا تتردد في السؤال إذا كان لديك أي استفسارات أخرى."
-        elif any(word in query_lower for word in ["عرض", "علامة", "أعراض"]):
-            return "تشمل أعراض سرطان الثدي الشائعة وجود كتلة أو سماكة في الثدي، تغير في حجم أو شكل الثدي، تغيرات في جلد الثدي (احمرار، نقر)، إفرازات من الحلمة، وألم في الثدي أو الحلمة. من المهم استشارة الطبيب إذا لاحظت أياً من هذه العلامات."
-        elif any(word in query_lower for word in ["علاج", "شفاء"]):
-            return "قد تشمل علاجات سرطان الثدي الجراحة (استئصال الورم أو استئصال الثدي)، والعلاج الإشعاعي، والعلاج الكيميائي، والعلاج الهرموني، والعلاجات المستهدفة. يتم تخصيص خطة العلاج بناءً على مرحلة السرطان، ونوعه، وخصائص المريضة."
-        elif any(word in query_lower for word in ["خطر", "عامل", "وقاية"]):
-            return "تشمل عوامل خطر الإصابة بسرطان الثدي العمر، والتاريخ العائلي، والطفرات الجينية (BRCA1 و BRCA2)، والتعرض للإستروجين، وزيادة الوزن بعد انقطاع الطمث، واستهلاك الكحول، وقلة النشاط البدني. تتضمن الوقاية نمط حياة صحي وفحص منتظم."
-        else:
-            return "لا يمكنني تقديم إجابة كاملة على هذا السؤال في الوقت الحالي. أقترح إعادة صياغة سؤالك أو استشارة أخصائي رعاية صحية للحصول على معلومات دقيقة حول سرطان الثدي."
-    
-    # Réponse par défaut (français)
-    else:
-        return "Je ne peux pas générer une réponse complète à cette question pour le moment. Je vous suggère de reformuler votre question ou de consulter un professionnel de santé pour obtenir des informations précises sur le cancer du sein."
+    tokens = set(_WORD_TOKEN_RE.findall(query.lower()))
+    
+    # Langue sans règles: réponse par défaut en français, sans test des mots
+    for keywords, response in _FALLBACK_TABLE.get(language, ()):
+        if not keywords.isdisjoint(tokens):
+            return response
+    
+    return _FALLBACK_DEFAULTS.get(language, _FB_FR_DEFAULT)
+
+def compile_keywords(keywords):
+    """
+    Compile une liste de mots-clés en une seule expression régulière.
+    
+    Le texte est parcouru une seule fois quel que soit le nombre de mots-clés,
+    au lieu d'un test de sous-chaîne par mot-clé.
+    
+    Args:
+        keywords (iterable): Mots-clés (en minuscules)
+        
+    Returns:
+        re.Pattern: Motif reconnaissant n'importe lequel des mots-clés
+    """
+    return re.compile("|".join(re.escape(kw) for kw in sorted(set(keywords), key=len, reverse=True)))
+
+def compile_categories(categories):
+    """
+    Compile des catégories de mots-clés ordonnées par priorité.
+    
+    Le motif utilise une assertion avant pour tester chaque position du texte;
+    à une position donnée, l'alternative retenue est celle de la catégorie la
+    plus prioritaire, ce qui reproduit exactement une série de tests
+    `any(kw in texte ...)` évalués dans l'ordre des catégories.
+    
+    Args:
+        categories (list): Listes de mots-clés, par ordre de priorité
+        
+    Returns:
+        tuple: (motif compilé, dictionnaire mot-clé -> rang de la catégorie)
+    """
+    priorities = {}
+    for rank, keywords in enumerate(categories):
+        for kw in keywords:
+            priorities.setdefault(kw, rank)
+    pattern = re.compile("(?=(" + "|".join(re.escape(kw) for kw in priorities) + "))")
+    return pattern, priorities
+
+def match_category(text, pattern, priorities):
+    """
+    Renvoie le rang de la catégorie la plus prioritaire présente dans le texte.
+    
+    Args:
+        text (str): Texte à analyser (en minuscules)
+        pattern (re.Pattern): Motif produit par compile_categories
+        priorities (dict): Rangs produits par compile_categories
+        
+    Returns:
+        int | None: Rang de la catégorie ou None si aucun mot-clé n'est présent
+    """
+    best = None
+    for match in pattern.finditer(text):
+        rank = priorities[match.group(1)]
+        if best is None or rank < best:
+            best = rank
+            if best == 0:
+                break
+    return best
+
+def build_category_classifier(categories):
+    """
+    Construit une fonction de classement spécialisée pour des catégories données.
+    
+    Les ensembles de mots-clés et le motif compilé sont liés une fois pour
+    toutes à la fonction renvoyée. Un mot du texte appartenant à la catégorie
+    prioritaire suffit à conclure; sinon le motif est parcouru pour trouver
+    les mots-clés, y compris à l'intérieur des mots.
+    
+    Args:
+        categories (list): Listes de mots-clés, par ordre de priorité
+        
+    Returns:
+        callable: Fonction (texte en minuscules) -> rang de la catégorie ou None
+    """
+    pattern, priorities = compile_categories(categories)
+    top_words = frozenset(categories[0]) if categories else frozenset()
+    
+    def classify(text):
+        if not top_words.isdisjoint(_WORD_TOKEN_RE.findall(text)):
+            return 0
+        return match_category(text, pattern, priorities)
+    
+    return classify